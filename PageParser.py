@@ -1,10 +1,14 @@
-import json
 import re
 import time
 import logging
 from enum import Enum
+from collections import OrderedDict
 from datetime import datetime
 
+from fastjson import dumps_value
+from fastjson import quote
+from psap_grammars import NORCOM_GRAMMAR, SNO911_GRAMMAR, VALCOM_GRAMMAR
+
 logger = logging.getLogger(__name__)
 
 class PagePSAP(Enum):
@@ -15,30 +19,127 @@ class PagePSAP(Enum):
 
     @classmethod
     def from_capcode(cls, capcode):
-        if capcode[:3] in ["147"]:
-            return cls(1)
-        elif capcode[:3] in ["131"]:
-            return cls(2)
-        if capcode[:3] in ["117"]:
-            return cls(3)
-        else:
-            return cls(0)
+        return CAPCODE_PREFIXES.get(capcode[:3], cls.NONE)
 
     def __str__(self):
         return self.name
-    
+
+# Capcode prefix -> PSAP, checked with a single hash lookup on the first 3 digits
+CAPCODE_PREFIXES = {
+    "147": PagePSAP.NORCOM,
+    "131": PagePSAP.SNO911,
+    "117": PagePSAP.VALCOM,
+}
+
+class PageKind:
+    """
+    Cheap up-front classification of a page, before its fields are parsed.
+    Plain strings rather than an Enum: member lookups on an Enum class are
+    several times slower, and these are checked on every page.
+    """
+    TEXT = 'text'
+    INCIDENT = 'incident'
+    KEEPALIVE = 'keepalive'
+
+KEEPALIVE_TEXT = "PAGEGATE KEEP ALIVE NORMAL"
+
+# Epoch seconds for the start of each "YYYY-MM-DD HH:MM" seen by parse_timestamp
+_minute_epochs = {}
+_MINUTE_EPOCHS_MAX = 4096
+
+def parse_timestamp(ts):
+    """
+    Convert a multimon-ng "YYYY-MM-DD HH:MM:SS" local timestamp to epoch seconds.
+
+    Gives the same result as int(datetime.strptime(ts, ...).timestamp()), but
+    the local timezone/DST conversion only runs once per minute of timestamps
+    and is cached; everything else is fixed-offset slicing. Timezone offsets
+    (including half-hour DST shifts) only change on minute boundaries.
+    """
+    if len(ts) != 19 or ts[16] != ':':
+        raise ValueError("expected YYYY-MM-DD HH:MM:SS timestamp, got {!r}".format(ts))
+
+    minute = ts[:16]
+    base = _minute_epochs.get(minute)
+    if base is None:
+        if (ts[4] != '-' or ts[7] != '-' or ts[10] != ' ' or ts[13] != ':'
+                or not (ts[:4] + ts[5:7] + ts[8:10] + ts[11:13] + ts[14:16]).isdigit()):
+            raise ValueError("expected YYYY-MM-DD HH:MM:SS timestamp, got {!r}".format(ts))
+
+        dt = datetime(int(ts[:4]), int(ts[5:7]), int(ts[8:10]), int(ts[11:13]), int(ts[14:16]))
+        base = int(dt.timestamp())
+        if len(_minute_epochs) >= _MINUTE_EPOCHS_MAX:
+            _minute_epochs.clear()
+        _minute_epochs[minute] = base
+
+    seconds = ts[17:]
+    if not seconds.isdigit() or seconds > "59":
+        raise ValueError("expected YYYY-MM-DD HH:MM:SS timestamp, got {!r}".format(ts))
+
+    return base + int(seconds)
+
+class ParseCache:
+    """
+    LRU cache of parsed page fields keyed on (page class, alpha text).
+
+    Dispatch sends the same text to several capcodes within seconds, so a
+    repeat only needs the per-capcode and timestamp fields rebuilt.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        fields = self._entries.get(key)
+        if fields is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return fields
+
+    def put(self, key, fields):
+        self._entries[key] = fields
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
 class PageParser:
+    """
+    The page parser used by norcom_pager and (through pagemodels) listen.py.
+
+    Lines are matched once against `pattern` (timestamp, capcode, alpha)
+    and dispatched on the capcode's PSAP to the Page class registered for
+    it with @page_type. The multimon-ng timestamp is optional; pages from
+    lines without one are stamped with the current time.
+    """
     # pattern = r"POCSAG1200:\s+Address:\s+(\d+)\s+Function:\s+\d\s+Alpha:\s+(.*)$"
-    pattern = r"([0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}):\s+POCSAG1200:\s+Address:\s+(\d+)\s+Function:\s+\d\s+Alpha:\s+(.*)$"
+    pattern = r"(?:([0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}):\s+)?POCSAG1200:\s+Address:\s+(\d+)\s+Function:\s+\d\s+Alpha:\s+(.*)$"
     pattern_re = None
 
     last_keepalive = 0
 
-    capcode_ignorelist = []
+    capcode_ignorelist = set()
 
-    def __init__(self, pattern=None):
+    # Only the default pattern is known to match the layout the prefilter expects
+    prefilter = True
+
+    def __init__(self, pattern=None, cache_size=256):
         if pattern is not None:
             self.pattern = pattern
+            self.prefilter = False
+
+        # Parsed fields of recently seen alpha texts (0 to disable)
+        self.cache = ParseCache(cache_size) if cache_size > 0 else None
 
         try:
             self.pattern_re = re.compile(self.pattern)
@@ -46,7 +147,45 @@ class PageParser:
             logging.error("Failed to load pattern: %s", err)
             raise ValueError("expected valid regex pattern, got %s", pattern)
 
+    def prefilter_line(self, line):
+        """
+        Cheap checks to drop lines before running the full pattern.
+
+        Returns the PSAP for the line's capcode, or None if the line isn't a
+        POCSAG1200 page, the capcode is ignored or it belongs to an unknown PSAP.
+        """
+        pos = line.find("POCSAG1200:", 0, 48)
+        if pos < 0:
+            logger.warning("Ignoring page: unknown page format")
+            logger.debug("Unknown format: %s", line)
+            return None
+
+        fields = line[pos + 11:].split(None, 2)
+        if len(fields) < 3 or fields[0] != "Address:":
+            logger.warning("Ignoring page: unknown page format")
+            logger.debug("Unknown format: %s", line)
+            return None
+
+        capcode = fields[1]
+        if capcode in self.capcode_ignorelist:
+            logger.info("Ignoring page: CAPCODE is on ignore list")
+            logger.debug("Ignored CAPCODE %s", capcode)
+            return None
+
+        psap = CAPCODE_PREFIXES.get(capcode[:3])
+        if psap is None:
+            logger.warning("Ignoring page: unknown CAPCODE")
+            return None
+
+        return psap
+
     def parse(self, line):
+        psap = None
+        if self.prefilter:
+            psap = self.prefilter_line(line)
+            if psap is None:
+                return None
+
         matches = self.pattern_re.match(line)
         if matches is None:
             logger.warning("Ignoring page: unknown page format")
@@ -64,84 +203,246 @@ class PageParser:
             logger.debug("%s: %s", err, line)
             return None
         
-        if capcode in PageParser.capcode_ignorelist:
-            logging.info("Ignoring page: CAPCODE is on ignore list")
+        if not self.prefilter and capcode in self.capcode_ignorelist:
+            logger.info("Ignoring page: CAPCODE is on ignore list")
             logger.debug("Ignored CAPCODE %s %s", capcode, alpha)
             return None
         
         # return {'raw': raw_page, 'capcode': capcode, 'alpha': alpha}
-        return self.create_page(raw_page, capcode, alpha, timestamp)
+        return self.create_page(raw_page, capcode, alpha, timestamp, psap)
 
-    def create_page(self, raw_page, capcode, page_alpha, timestamp):
+    def create_page(self, raw_page, capcode, page_alpha, timestamp, psap=None):
         
-        psap = PagePSAP.from_capcode(capcode)
-
-        if psap == PagePSAP.NORCOM:
-            return PageNorcom(raw=raw_page, capcode=capcode, alpha=page_alpha, ts=timestamp)
-        elif psap == PagePSAP.VALCOM:
-            # VALCOM processor will just discard them for now
-            return PageValcom(raw=raw_page, capcode=capcode, alpha=page_alpha, ts=timestamp)
-        elif psap == PagePSAP.SNO911:
-            return PageSnohomish(raw=raw_page, capcode=capcode, alpha=page_alpha, ts=timestamp)
-        else:
+        if psap is None:
+            psap = PagePSAP.from_capcode(capcode)
+
+        # VALCOM processor will just discard them for now
+        page_class = PAGE_CLASSES.get(psap)
+        if page_class is None:
             # Unknown capcode
-            logging.warn("Ignoring page: unknown CAPCODE")
+            logger.warning("Ignoring page: unknown CAPCODE")
+            return None
 
-        return None
+        if self.cache is None:
+            return page_class(raw=raw_page, capcode=capcode, alpha=page_alpha, ts=timestamp)
+
+        key = (page_class, page_alpha)
+        fields = self.cache.get(key)
+        if fields is not None:
+            return page_class.from_parsed(raw_page, capcode, page_alpha, timestamp, psap, fields)
+
+        page = page_class(raw=raw_page, capcode=capcode, alpha=page_alpha, ts=timestamp)
+        # Cached when (and if) its fields get parsed
+        page._cache = (self.cache, key)
+        return page
+
+# Key layout of Page.to_dict(), as json.dumps would render it
+PAGE_JSON_TEMPLATE = (
+    '{"timestamp": %s, "capcode": %s, "agency": %s, "psap": %s, "channel": %s, "units": %s, '
+    '"location": {"name": %s, "address": %s, "geo": %s}, '
+    '"incident": {"type": %s, "subtype": %s}, '
+    '"alarm_level": %s, "reference": %s, "cad_notes": %s}'
+)
+
+# PSAP -> Page subclass that parses its pages, filled in by @page_type
+PAGE_CLASSES = {}
+
+def page_type(psap):
+    """ Class decorator registering the Page subclass for a PSAP's pages """
+    def register(cls):
+        if psap in PAGE_CLASSES:
+            raise ValueError("{} already has a page type: {}".format(psap, PAGE_CLASSES[psap].__name__))
+        PAGE_CLASSES[psap] = cls
+        return cls
+    return register
 
 class Page:
-    # TODO: Make the internal structure more closely match the json model
-
-    timestamp = 0
-    parsed = False
-    keepalive = False
-    skipped = False
-    skip_reason = "unknown"
+    # Slots follow the layout of the json model (see to_json), with the
+    # parser state flags first. The parsed fields are left unset until the
+    # first one is read (see __getattr__), then all of them are set per
+    # instance so mutable values like units and geo are never shared
+    # between pages.
+    __slots__ = (
+        'timestamp',
+        'kind',
+        'parsed',
+        'keepalive',
+        'skipped',
+        'skip_reason',
+        'psap',
+        'raw',
+        'capcode',
+        'alpha',
+        'channel',
+        'units',
+        'address_name',
+        'address_raw',
+        'address_parsed',
+        'geo',
+        'call_type',
+        'call_subtype',
+        'alarm_level',
+        'call_id',
+        'call_notes',
+        '_cache',
+    )
+
+    # page_grammar grammar of the PSAP's incident pages (see psap_grammars)
+    grammar = None
+
+    def __init__(self, raw, capcode, alpha, ts=None, psap=PagePSAP.NONE):
+        self.raw = raw
+        self.capcode = capcode
+        self.alpha = alpha
+        self.psap = psap
 
-    psap = PagePSAP.NONE  
+        self.timestamp = self.get_timestamp(ts)
+
+        # Routing only needs the classification; parse_page() runs on first
+        # access to a parsed field
+        self.kind = self.classify()
+        # (ParseCache, key) to store the fields in once they're parsed
+        self._cache = None
+
+    # Fields set by parse_page(); they only depend on the alpha text
+    PARSED_FIELDS = (
+        'parsed',
+        'keepalive',
+        'skipped',
+        'skip_reason',
+        'channel',
+        'units',
+        'address_name',
+        'address_raw',
+        'address_parsed',
+        'geo',
+        'call_type',
+        'call_subtype',
+        'alarm_level',
+        'call_id',
+        'call_notes',
+    )
+    _PARSED_FIELD_SET = frozenset(PARSED_FIELDS)
+
+    # What the parse cache keeps: the classification and the parsed fields
+    CACHED_FIELDS = ('kind',) + PARSED_FIELDS
+
+    def __getattr__(self, name):
+        # Only called for unset slots, i.e. parsed fields before the first parse
+        if name not in self._PARSED_FIELD_SET:
+            raise AttributeError("{!r} object has no attribute {!r}".format(type(self).__name__, name))
+        self._parse()
+        return getattr(self, name)
+
+    def ensure_parsed(self):
+        """ Parse the fields now if they haven't been, e.g. before other threads read the page """
+        try:
+            object.__getattribute__(self, 'parsed')
+        except AttributeError:
+            self._parse()
+
+    def __getstate__(self):
+        # Pickled pages (from backfill workers) go parsed and without the cache
+        state = {name: getattr(self, name) for name in Page.__slots__}
+        state['_cache'] = None
+        return None, state
+
+    def _parse(self):
+        """ Set the parsed fields to their defaults and run parse_page() """
+        self.parsed = False
+        self.keepalive = False
+        self.skipped = False
+        self.skip_reason = "unknown"
+
+        self.channel = None
+        self.units = []
+        self.address_name = None
+        self.address_raw = None
+        self.address_parsed = None
+        self.geo = {}
+        self.call_type = None
+        self.call_subtype = None
+        self.alarm_level = None
+        self.call_id = None
+        self.call_notes = None
 
-    raw = None
-    capcode = None
-    alpha = None
+        self.parse_page()
 
-    call_type = None
-    call_subtype = None
-    call_notes = None
-    call_id = None
+        if self._cache is not None:
+            cache, key = self._cache
+            self._cache = None
+            cache.put(key, self.parsed_fields())
 
-    alarm_level = None
+    @classmethod
+    def from_parsed(cls, raw, capcode, alpha, ts, psap, fields):
+        """ Build a page from parsed_fields() of another page with the same alpha text """
+        page = cls.__new__(cls)
+        page.raw = raw
+        page.capcode = capcode
+        page.alpha = alpha
+        page.psap = psap
+        for name, value in zip(cls.CACHED_FIELDS, fields):
+            setattr(page, name, value)
+        # Every page gets its own units and geo, as in _parse
+        page.units = list(page.units)
+        page.geo = dict(page.geo)
+        page.timestamp = page.get_timestamp(ts)
+        page._cache = None
+        return page
+
+    def parsed_fields(self):
+        """ Snapshot of the classification and parse_page() results to build other pages from """
+        values = (getattr(self, name) for name in self.CACHED_FIELDS)
+        # Copy units/geo so later changes to this page don't reach the cache
+        return tuple(value.copy() if isinstance(value, (list, dict)) else value for value in values)
+
+    def classify(self):
+        """ Cheap check of what kind of page this is, without parsing it """
+        if self.alpha is None or self.grammar is None:
+            return PageKind.TEXT
+
+        text = self.grammar.clean(self.alpha)
+        if KEEPALIVE_TEXT in text:
+            return PageKind.KEEPALIVE
+        if not self.grammar.matches(text):
+            return PageKind.TEXT
+        return PageKind.INCIDENT
 
-    channel = None
+    def parse_page(self):
+        if self.alpha is None:
+            return None
 
-    address_name = None
-    address_raw = None
-    address_parsed = {}
+        if self.grammar is None:
+            logger.debug("%s: Discarding page - not yet implemented", self.psap)
+            return None
 
-    units = []
-    geo = {}
+        logger.debug("Attempting to parse as %s", self.psap)
 
-    def __init__(self, raw, capcode, alpha, ts=None):
-        self.raw = raw
-        self.capcode = capcode
-        self.alpha = alpha
+        if self.kind == PageKind.KEEPALIVE:
+            self.call_type = "PAGEGATE KEEPALIVE"
+            self.keepalive = True
+            return True
 
-        if ts is None:
-            self.timestamp = time.time()
-        else:
-            dt = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-            self.timestamp = int(dt.timestamp())
+        if self.kind == PageKind.TEXT:
+            # Free text; norcom_pager routes these on their kind alone
+            self.skipped = True
+            self.skip_reason = "malformed"
+            logger.debug("Not an incident page: %s", self.alpha)
+            return False
 
-        self.parse_page()
+        if not self.grammar.parse(self):
+            self.skipped = True
+            self.skip_reason = "malformed"
+            return False
 
-    def parse_page(self):
-        raise NotImplementedError("Parser not implemented")
+        self.parsed = True
+        return True
     
     def get_timestamp(self, ts):
         if ts is None:
             return time.time()
         
-        dt = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-        return int(dt.timestamp())
+        return parse_timestamp(ts)
     
     def get_calltype(self):
         """ Re-join the call type components if they're not empty """
@@ -150,9 +451,9 @@ class Page:
         else:
             return self.call_type
 
-    def to_json(self):
+    def to_dict(self):
         # I would not consider this a stable interface quite yet
-        page_data = {
+        return {
             'timestamp': self.timestamp,
             'capcode': self.capcode,
             'agency': str(self.psap), # TODO: Remove agency after transition
@@ -172,201 +473,50 @@ class Page:
             'reference': self.call_id,
             'cad_notes': self.call_notes
         }
-        return json.dumps(page_data)
 
+    def to_json(self):
+        """ Same output as json.dumps(self.to_dict()), without building the dict """
+        psap = quote(str(self.psap))
+        return PAGE_JSON_TEMPLATE % (
+            dumps_value(self.timestamp),
+            dumps_value(self.capcode),
+            psap,
+            psap,
+            dumps_value(self.channel),
+            dumps_value(self.units),
+            dumps_value(self.address_name),
+            dumps_value(self.address_raw),
+            dumps_value(self.geo),
+            dumps_value(self.call_type),
+            dumps_value(self.call_subtype),
+            dumps_value(self.alarm_level),
+            dumps_value(self.call_id),
+            dumps_value(self.call_notes),
+        )
+
+    def to_json_bytes(self):
+        return self.to_json().encode('ascii')
+
+@page_type(PagePSAP.SNO911)
 class PageSnohomish(Page):
-    def __init__(self, raw, capcode, alpha, ts=None, psap=PagePSAP.SNO911):
-        super().__init__(raw, capcode, alpha)
-        self.psap = psap
-        
-    def parse_page(self):
-        if self.alpha is None:
-            return None
-
-        parse_alpha = self.alpha.replace("<EOT>","").replace("<NUL>","")
+    __slots__ = ()
+    grammar = SNO911_GRAMMAR
 
-        if "PAGEGATE KEEP ALIVE NORMAL" in parse_alpha:
-            logger.debug("Attempting to parse as SNO911 KEEPALIVE")
-            self.call_type = "PAGEGATE KEEPALIVE"
-            self.keepalive = True
-            return True
-        
-        logger.debug("Attempting to parse as SNO911")
-
-        try:
-            type_match = re.match(r">>([A-Za-z0-9 -]+)<<", parse_alpha)
-
-            if type_match is None:
-                # This is probably not a valid event
-                self.skipped = True
-                self.skip_reason = "malformed"
-                logger.warning("PARSE FAILED: missing call type %s", self.alpha)
-                return False
-
-            call_types = type_match.group(1)
-
-            (self.call_type, self.call_subtype) = [ k.strip() for k in call_types.split('-', 1) ]
-
-            # Remove the call type from the text and keep parsing
-            parse_alpha = parse_alpha.replace(type_match.group(0), '').strip()
-
-            parse_groups = parse_alpha.split('/')
-            channel_address = parse_groups[0].strip()
-            self.address_name = parse_groups[1].strip()
-            call_details = parse_groups[2].strip()
-
-            channel_match = re.match(r"(FIRE\s+TAC\s+\d+)", parse_alpha)
-            if channel_match is not None:
-                self.channel = channel_match.group(1)
-                parse_alpha = parse_alpha.replace(self.channel, '').strip()
-            
-            alarm_match = re.match(r"-\s+Alarm Level:\s+(\d+)", parse_alpha)
-            if alarm_match is not None:
-                self.alarm_level = alarm_match.group(1)
-                parse_alpha = parse_alpha.replace(alarm_match.group(0), '').strip()
-            
-            address_match = re.match(r"(.*)\/(.*?)\/\s+([A-Z0-9]+)?\s?\*", parse_alpha)
-            if address_match is not None:
-                self.address_raw = address_match.group(1)
-                self.address_name = address_match.group(2)
-                if (len(address_match.groups()) == 3):
-                    self.call_id = address_match.group(3)
-
-                call_details = parse_alpha.replace(address_match.group(0)[:-1], '')
-            else:
-                self.skipped = True
-                self.skip_reason = "malformed"
-                logger.warning("PARSE FAILED: couldn't parse address fields %s", self.alpha)
-                return False
-            
-            unit_match = re.match(r"\*+([A-Za-z0-9\s,]+)\*?", call_details)
-
-            if unit_match is None:
-                self.skipped = True
-                self.skip_reason = "malformed"
-                logger.warning("PARSE FAILED: couldn't parse units %s", self.alpha)
-                return False
-
-            # Some pages are too long to include all of the units
-            if (unit_match.group(0)[-1:] != "*"):
-                # Reached the end of text without the other delimiter
-                units = [ k.strip() for k in unit_match.group(1).split(',') ]
-                call_details = ""
-
-                # pop the last element if it doesn't conform to the expected unit format
-                unit_id_match = re.match(r"[A-Z]+[0-9]+", units[-1:].pop())
-                if unit_id_match is None:
-                    units.pop()
-
-                self.units = units
-
-            else:
-                self.units = [ k.strip() for k in unit_match.group(1).split(',') ]
-                self.call_notes = call_details.replace(unit_match.group(0), '').strip()
-        except (IndexError, ValueError) as err:
-            logger.warning("PARSE FAILED: %s %s".format(err, self.alpha))
-            self.skip_reason = "malformed"
-            self.skipped = True
-            return False
-
-        self.parsed = True
-        return True
+    def __init__(self, raw, capcode, alpha, ts=None, psap=PagePSAP.SNO911):
+        super().__init__(raw, capcode, alpha, ts, psap)
 
+@page_type(PagePSAP.NORCOM)
 class PageNorcom(Page):
-    def __init__(self, raw, capcode, alpha, ts=None, psap=PagePSAP.NORCOM):
-        super().__init__(raw, capcode, alpha)
-        self.psap = psap
-
-    def _parse_call_type(self, call_text):
-        call = re.sub(r'[<>]', '', call_text)
-        logger.debug("Parsed call type: %s", call)
-
-    def parse_page(self):
-        if self.alpha is None:
-            return None
-        
-        logger.debug("Attempting to parse as NORCOM")
+    __slots__ = ()
+    grammar = NORCOM_GRAMMAR
 
-        if "PAGEGATE KEEP ALIVE NORMAL" in self.alpha:
-            self.call_type = "PAGEGATE KEEPALIVE"
-            self.keepalive = True
-            return True
+    def __init__(self, raw, capcode, alpha, ts=None, psap=PagePSAP.NORCOM):
+        super().__init__(raw, capcode, alpha, ts, psap)
 
-        try:
-            parse_alpha = self.alpha.replace("<EOT>","").replace("<NUL>","").split(';')
- 
-            if len(parse_alpha) != 7:
-                self.skip_reason = "malformed"
-                self.skipped = True
-                logger.error("PARSE FAILED: unexpected field count: %s", self.alpha)
-                return False
-            
-            (call, channel, addr_name, addr_street, units, geo_lat, geo_long) = [ None ] * 7
-
-            geo_long = parse_alpha.pop()
-            if geo_long is not None:
-                geo_match = re.match(r'-12[0-9]\.[0-9]+',geo_long)
-                if geo_match is not None:
-                    geo_long = geo_match.group(0)
-
-            geo_lat = parse_alpha.pop()
-            if geo_lat is not None:
-                geo_match = re.match(r'47\.[0-9]+',geo_lat)
-                if geo_match is not None:
-                    geo_lat = geo_match.group(0)
-
-            units = parse_alpha.pop()
-
-            addr_street = parse_alpha.pop().strip()
-            if addr_street is None:
-                # Don't even bother parsing the rest
-                self.skip_reason = "malformed"
-                self.skipped = True
-                logger.error("PARSE FAILED: Missing expected fields %s", self.alpha)
-                return False
-
-            addr_name = parse_alpha.pop().strip()
-
-            channel = parse_alpha.pop().strip()
-            call = parse_alpha.pop().strip()
-
-            call = re.sub(r'[<>]', '', call)
-            if "-" in call:
-                (self.call_type, self.call_subtype) = [ k.strip() for k in call.split('-', 1) ]
-            else:
-                self.call_type = call
-
-            self.channel = re.sub(r'[\* -]','',channel)
-            self.address_name = addr_name
-            self.address_raw = addr_street
-
-            self.units = []
-            if units is not None:
-                for unit in units.split(','):
-                    if len(unit.strip()) < 3:
-                        continue
-                    self.units.append(unit.strip())
-
-            self.geo = {'lat': geo_lat, 'long': geo_long }
-        except (ValueError, IndexError) as err:
-            # Couldn't unpack values correctly
-            logger.error("PARSE FAILED: {} {}".format(err, self.alpha))
-            self.skipped = True
-            self.skip_reason = "malformed"
-            return False
-        
-        self.parsed = True
-        return True
-    
+@page_type(PagePSAP.VALCOM)
 class PageValcom(Page):
-    def __init__(self, raw, capcode, alpha, ts=None, psap=PagePSAP.VALCOM):
-        super().__init__(raw, capcode, alpha)
-        self.psap = psap
+    __slots__ = ()
+    grammar = VALCOM_GRAMMAR
 
-    def parse_page(self):
-        if self.alpha is None:
-            return None
-        
-        # logger.debug("Attempting to parse as VALCOM")
-        logger.debug("VALCOM: Discarding page - not yet implemented")
-        return None
+    def __init__(self, raw, capcode, alpha, ts=None, psap=PagePSAP.VALCOM):
+        super().__init__(raw, capcode, alpha, ts, psap)
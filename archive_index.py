@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Sparse time index for raw multimon-ng captures and NDJSON page output.
+
+The index lives next to the archive as <file>.idx. It is a text file with
+one line per block of the archive:
+
+    <start offset> <end offset> <first ts> <high water ts> <capcodes>
+
+Blocks close every `block_bytes` bytes or `block_seconds` seconds of
+timestamps. The high water mark is the largest timestamp seen up to the
+end of the block, so it only ever increases and can be bisected even if
+the capture clock stepped backwards. The capcodes column lists the
+capcodes seen in the block ("-" for none) so capcode searches can skip
+whole blocks.
+
+The tail of the archive after the last closed block isn't indexed and is
+scanned linearly, so an index that lags behind a growing file (e.g. one
+written by tee) is still correct, just slower. Writers resuming an
+existing archive index that tail before appending.
+
+    ./archive_index.py build /app/raw
+    ./archive_index.py search /app/raw --since "2024-01-05 12:00:00" --until "2024-01-05 13:00:00"
+"""
+import os
+import re
+import sys
+import json
+import bisect
+import logging
+import argparse
+
+from PageParser import parse_timestamp
+from capture_reader import CaptureReader
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".idx"
+INDEX_HEADER = b"# archive-index v1\n"
+
+NDJSON_PREFIX_RE = re.compile(rb'\{"timestamp": (-?[0-9.]+), "capcode": (?:"([^"]*)"|null)')
+
+
+def line_info(line):
+    """
+    Return (timestamp, capcode) for a raw capture or NDJSON line (bytes).
+    Either may be None if the line doesn't carry it.
+    """
+    if line[:1] == b'{':
+        match = NDJSON_PREFIX_RE.match(line)
+        if match is not None:
+            capcode = match.group(2)
+            return int(float(match.group(1))), capcode.decode('ascii', 'replace') if capcode else None
+        try:
+            data = json.loads(line.rstrip(b",\r\n"))
+            return int(data['timestamp']), data.get('capcode')
+        except (ValueError, KeyError, TypeError):
+            return None, None
+
+    if len(line) < 20 or line[19:20] != b':':
+        return None, None
+    try:
+        timestamp = parse_timestamp(line[:19].decode('ascii'))
+    except (ValueError, UnicodeDecodeError):
+        return None, None
+
+    capcode = None
+    pos = line.find(b"Address:", 20, 80)
+    if pos >= 0:
+        fields = line[pos + 8:pos + 32].split(None, 1)
+        if fields:
+            capcode = fields[0].decode('ascii', 'replace')
+    return timestamp, capcode
+
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def format_entry(start, end, first_ts, high_water, capcodes):
+    return "{} {} {} {} {}\n".format(
+        start, end, first_ts, high_water, ",".join(sorted(capcodes or ())) or "-").encode('ascii')
+
+
+class IndexBuilder:
+    """
+    Build the index incrementally. Call observe() with the offset and bytes
+    of every line as it's appended to the archive.
+    """
+
+    def __init__(self, path, block_bytes=64 * 1024, block_seconds=300, resume=True):
+        self.path = index_path(path)
+        self.block_bytes = block_bytes
+        self.block_seconds = block_seconds
+
+        self.block_start = None
+        self.block_end = None
+        self.first_ts = None
+        self.high_water = None
+        self.capcodes = set()
+
+        last = None
+        if resume and os.path.exists(self.path):
+            try:
+                entries = load_entries(self.path)
+            except ValueError as err:
+                logger.warning("Rebuilding archive index: %s", err)
+                entries = []
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if entries and entries[-1][1] <= size:
+                last = entries[-1]
+                self.high_water = last[3]
+
+        # Rewrite what we kept so a torn last line from a crash is dropped
+        self._fh = open(self.path, 'wb')
+        self._fh.write(INDEX_HEADER)
+        if last is not None:
+            self._fh.write(b"".join(format_entry(*entry) for entry in entries))
+        self._fh.flush()
+        self.indexed_to = last[1] if last else 0
+
+    def observe(self, offset, line):
+        timestamp, capcode = line_info(line)
+        end = offset + len(line)
+
+        if self.block_start is None:
+            self.block_start = offset
+        elif (end - self.block_start > self.block_bytes
+              or (timestamp is not None and self.first_ts is not None
+                  and timestamp - self.first_ts >= self.block_seconds)):
+            if self.close_block():
+                self.block_start = offset
+
+        self.block_end = end
+        if timestamp is not None:
+            if self.first_ts is None:
+                self.first_ts = timestamp
+            if self.high_water is None or timestamp > self.high_water:
+                self.high_water = timestamp
+        if capcode:
+            self.capcodes.add(capcode)
+
+    def close_block(self):
+        """ Write the current block's entry; False if it's kept open (no timestamp yet) """
+        if self.block_start is None or self.first_ts is None:
+            # Nothing with a timestamp yet; keep the lines in the next block
+            return False
+        self._fh.write(format_entry(self.block_start, self.block_end, self.first_ts,
+                                    self.high_water, self.capcodes))
+        self._fh.flush()
+        self.indexed_to = self.block_end
+        self.block_start = None
+        self.first_ts = None
+        self.capcodes = set()
+        return True
+
+    def catch_up(self, archive_path):
+        """ Index anything appended to the archive since the last closed block """
+        offset = self.indexed_to
+        with open(archive_path, 'rb') as fh:
+            fh.seek(offset)
+            for line in fh:
+                if not line.endswith(b"\n"):
+                    # Partial last line, it'll be finished by the next append
+                    break
+                self.observe(offset, line)
+                offset += len(line)
+        return offset
+
+    def close(self):
+        self.close_block()
+        self._fh.close()
+
+
+class RawArchive:
+    """ Append-only raw capture file that keeps its index up to date """
+
+    def __init__(self, path, block_bytes=64 * 1024, block_seconds=300):
+        self.path = os.path.expanduser(path)
+        self._fh = open(self.path, 'ab')
+        self.index = IndexBuilder(self.path, block_bytes=block_bytes, block_seconds=block_seconds)
+        self._fh.seek(0, os.SEEK_END)
+        self.offset = self.index.catch_up(self.path)
+        if self.offset < self._fh.tell():
+            # Finish a line left unterminated by a crash so offsets stay line-aligned
+            self._fh.write(b"\n")
+            self.offset = self._fh.tell()
+
+    def append(self, line):
+        if isinstance(line, str):
+            line = line.encode('utf-8', errors='replace')
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        self._fh.write(line)
+        self._fh.flush()
+        self.index.observe(self.offset, line)
+        self.offset += len(line)
+
+    def close(self):
+        self._fh.close()
+        self.index.close()
+
+
+def load_entries(path):
+    """ Load index entries as (start, end, first ts, high water, capcodes) tuples """
+    entries = []
+    with open(path, 'rb') as fh:
+        if fh.readline() != INDEX_HEADER:
+            raise ValueError("{} is not an archive index".format(path))
+        for line in fh:
+            fields = line.split()
+            if len(fields) != 5 or not line.endswith(b"\n"):
+                # Partial last line from a crash
+                break
+            capcodes = None if fields[4] == b"-" else frozenset(fields[4].decode('ascii').split(","))
+            entries.append((int(fields[0]), int(fields[1]), int(fields[2]), int(fields[3]), capcodes))
+    return entries
+
+
+def rebuild_index(path, block_bytes=64 * 1024, block_seconds=300):
+    """ Index an existing archive from scratch. Returns the number of blocks. """
+    builder = IndexBuilder(path, block_bytes=block_bytes, block_seconds=block_seconds, resume=False)
+    offset = 0
+    with open(path, 'rb') as fh:
+        for line in fh:
+            builder.observe(offset, line)
+            offset += len(line)
+    builder.close()
+    return len(load_entries(builder.path))
+
+
+class IndexedArchive:
+    """ Seek into an archive by time (and optionally capcode) using its index """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        if os.path.exists(index_path(path)):
+            self.entries = load_entries(index_path(path))
+            if self.entries and self.entries[-1][1] > os.path.getsize(path):
+                logger.warning("Index for %s is newer than the file, ignoring it", path)
+                self.entries = []
+        self.high_water = [entry[3] for entry in self.entries]
+
+    def offset(self, since):
+        """ Byte offset of the first block that can hold lines at or after since """
+        first = bisect.bisect_left(self.high_water, since)
+        if first < len(self.entries):
+            return self.entries[first][0]
+        return self.entries[-1][1] if self.entries else 0
+
+    def end_offset(self, until, start=0):
+        """ Byte offset to stop reading at for lines before until (None: end of file) """
+        for entry in self.entries:
+            if entry[0] >= start and entry[2] >= until:
+                return entry[0]
+        return None
+
+    def lines(self, since=None, until=None, capcode=None):
+        """
+        Yield (offset, line) for lines with since <= timestamp < until and,
+        if given, a matching capcode. Lines without a timestamp are only
+        returned when no time range is given.
+        """
+        first = 0
+        if since is not None:
+            first = bisect.bisect_left(self.high_water, since)
+
+        with CaptureReader(self.path) as reader:
+            for start, end, first_ts, _, capcodes in self.entries[first:]:
+                if until is not None and first_ts >= until:
+                    return
+                if capcode is not None and capcodes is not None and capcode not in capcodes:
+                    continue
+                reader.seek(start)
+                yield from self._filter(reader.lines(end), since, until, capcode)
+
+            reader.seek(self.entries[-1][1] if self.entries else 0)
+            yield from self._filter(reader.lines(), since, until, capcode)
+
+    def _filter(self, lines, since, until, capcode):
+        if since is None and until is None and capcode is None:
+            yield from lines
+            return
+
+        for offset, line in lines:
+            timestamp, line_capcode = line_info(line)
+            if since is not None or until is not None:
+                if timestamp is None:
+                    continue
+                if since is not None and timestamp < since:
+                    continue
+                if until is not None and timestamp >= until:
+                    continue
+            if capcode is not None and line_capcode != capcode:
+                continue
+            yield offset, line
+
+
+def parse_time_arg(value):
+    """ Accept epoch seconds or YYYY-MM-DD HH:MM:SS local time """
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    return parse_timestamp(value)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Build or search an archive time index")
+    sub = argparser.add_subparsers(dest='command', required=True)
+
+    build = sub.add_parser('build', help='Rebuild the index for an archive')
+    build.add_argument('file')
+    build.add_argument('--block-bytes', type=int, default=64 * 1024)
+    build.add_argument('--block-seconds', type=int, default=300)
+
+    search = sub.add_parser('search', help='Print lines in a time range')
+    search.add_argument('file')
+    search.add_argument('--since', help='Start time (YYYY-MM-DD HH:MM:SS or epoch)')
+    search.add_argument('--until', help='End time (YYYY-MM-DD HH:MM:SS or epoch)')
+    search.add_argument('--capcode', help='Only lines for this capcode')
+
+    args = argparser.parse_args()
+
+    if args.command == 'build':
+        blocks = rebuild_index(args.file, block_bytes=args.block_bytes, block_seconds=args.block_seconds)
+        print("Indexed {} blocks to {}".format(blocks, index_path(args.file)))
+        return
+
+    try:
+        since = parse_time_arg(args.since)
+        until = parse_time_arg(args.until)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+    out = sys.stdout.buffer
+    for _, line in IndexedArchive(args.file).lines(since=since, until=until, capcode=args.capcode):
+        out.write(line)
+
+
+if __name__ == "__main__":
+    main()
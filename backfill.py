@@ -0,0 +1,218 @@
+"""
+Parallel parsing of raw multimon-ng captures for bulk backfills.
+
+Each capture is split into line-aligned chunks of about `chunk_bytes`,
+which are parsed on a process pool. Every chunk comes back sorted by page
+timestamp, and the chunks of each window of in-flight work (`workers`
+chunks) are merged with heapq.merge. Captures are read in order of their
+first timestamp (whatever order they're given in) and are appended in
+time order, so windows only overlap when the capture clock stepped
+backwards or two captures cover the same time.
+"""
+import os
+import time
+import heapq
+import logging
+import logging.handlers
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from PageParser import PageParser
+from archive_index import IndexedArchive, line_info
+
+logger = logging.getLogger(__name__)
+
+COUNT_KEYS = ('lines', 'pages', 'parsed', 'keepalive', 'skipped', 'unparsed')
+
+# Parser for the worker process, created by _init_worker
+_parser = None
+
+
+def split_chunks(path, chunk_bytes, start=0, size=None):
+    """ Return (path, start, end) byte ranges that each end on a line boundary """
+    if size is None:
+        size = os.path.getsize(path)
+    chunks = []
+    with open(path, 'rb') as fh:
+        while start < size:
+            end = start + chunk_bytes
+            if end >= size:
+                end = size
+            else:
+                fh.seek(end)
+                fh.readline()
+                end = fh.tell()
+            chunks.append((path, start, end))
+            start = end
+    return chunks
+
+
+def first_timestamp(path, max_bytes=1024 * 1024):
+    """ Timestamp of the first page in a capture, from its index if it has one (None if there's none) """
+    archive = IndexedArchive(path)
+    if archive.entries:
+        return archive.entries[0][2]
+
+    with open(path, 'rb') as fh:
+        for line in fh:
+            timestamp, _ = line_info(line)
+            if timestamp is not None:
+                return timestamp
+            if fh.tell() >= max_bytes:
+                break
+    return None
+
+
+def order_captures(paths):
+    """ Sort captures by their first timestamp; ones without any go last, in the given order """
+    first = {path: first_timestamp(path) for path in paths}
+    ordered = sorted(paths, key=lambda path: (first[path] is None, first[path] or 0))
+    if ordered != paths:
+        logger.info("Backfilling captures in time order: %s", ", ".join(ordered))
+    return ordered
+
+
+class _WorkerLogHandler(logging.handlers.QueueHandler):
+    """ Sends a worker's log records to the parent process """
+
+    def prepare(self, record):
+        # Keep the message template, so the parent's rate limits still apply;
+        # tracebacks don't pickle, so those records are formatted here
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+
+class _ParentLoggers:
+    """ Handles the records of the workers with the parent's own loggers """
+
+    def handle(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def _init_worker(cache_size, log_queue, log_level):
+    global _parser
+    _parser = PageParser(cache_size=cache_size)
+
+    # Spawned workers don't inherit the parent's logging setup
+    root = logging.getLogger()
+    root.setLevel(log_level)
+    root.handlers[:] = [_WorkerLogHandler(log_queue)]
+
+
+def parse_chunk(path, start, end, since=None, until=None):
+    """ Parse one chunk in a worker. Returns a dict of pages (by timestamp), counts and timing. """
+    started = time.perf_counter()
+    counts = dict.fromkeys(COUNT_KEYS, 0)
+    pages = []
+
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+
+    for raw in data.splitlines():
+        if since is not None or until is not None:
+            timestamp, _ = line_info(raw)
+            if timestamp is None or (since is not None and timestamp < since) \
+                    or (until is not None and timestamp >= until):
+                continue
+
+        counts['lines'] += 1
+        page = _parser.parse(raw.decode('utf-8', errors='replace').strip())
+        if page is None:
+            continue
+
+        counts['pages'] += 1
+        if page.parsed:
+            counts['parsed'] += 1
+        elif page.keepalive:
+            counts['keepalive'] += 1
+        elif page.skipped:
+            counts['skipped'] += 1
+        else:
+            counts['unparsed'] += 1
+        pages.append(page)
+
+    # Stable, so pages with the same second keep their capture order
+    pages.sort(key=lambda page: page.timestamp)
+
+    return {
+        'pid': os.getpid(),
+        'bytes': end - start,
+        'seconds': time.perf_counter() - started,
+        'counts': counts,
+        'pages': pages,
+    }
+
+
+class Backfill:
+    """
+    Iterate over the pages of one or more captures, parsed in parallel.
+    counts and worker_stats (per worker process) fill in as pages() runs.
+    """
+
+    def __init__(self, paths, workers=None, chunk_bytes=8 * 1024 * 1024, cache_size=256, since=None, until=None):
+        self.paths = order_captures([os.path.expanduser(path) for path in paths])
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_bytes = chunk_bytes
+        self.cache_size = cache_size
+        self.since = since
+        self.until = until
+
+        self.counts = dict.fromkeys(COUNT_KEYS, 0)
+        self.worker_stats = {}
+
+    def chunks(self):
+        chunks = []
+        for path in self.paths:
+            # Skip straight to the time window with the capture's index if it has one
+            archive = IndexedArchive(path)
+            start = archive.offset(self.since) if self.since is not None else 0
+            end = archive.end_offset(self.until, start) if self.until is not None else None
+            chunks.extend(split_chunks(path, self.chunk_bytes, start, end))
+        return chunks
+
+    def _collect(self, result):
+        for key, value in result['counts'].items():
+            self.counts[key] += value
+
+        stats = self.worker_stats.setdefault(result['pid'], {
+            'chunks': 0, 'bytes': 0, 'lines': 0, 'pages': 0, 'seconds': 0.0,
+        })
+        stats['chunks'] += 1
+        stats['bytes'] += result['bytes']
+        stats['lines'] += result['counts']['lines']
+        stats['pages'] += result['counts']['pages']
+        stats['seconds'] += result['seconds']
+        return result['pages']
+
+    def pages(self):
+        chunks = self.chunks()
+        logger.info("Backfilling %d chunks from %d files on %d workers",
+                    len(chunks), len(self.paths), self.workers)
+
+        # Spawn fresh workers: forking after the MQTT and outbox threads have
+        # started can deadlock on a lock one of them held
+        context = multiprocessing.get_context('spawn')
+        log_queue = context.Queue()
+        log_listener = logging.handlers.QueueListener(log_queue, _ParentLoggers())
+        log_listener.start()
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                     initargs=(self.cache_size, log_queue, logging.getLogger().level)) as pool:
+                # Keep two windows in flight so workers don't idle while a window is merged
+                window = self.workers
+                futures = [pool.submit(parse_chunk, *chunk, self.since, self.until) for chunk in chunks[:window * 2]]
+                submitted = len(futures)
+
+                while futures:
+                    current, futures = futures[:window], futures[window:]
+                    for chunk in chunks[submitted:submitted + len(current)]:
+                        futures.append(pool.submit(parse_chunk, *chunk, self.since, self.until))
+                    submitted += len(current)
+
+                    results = [self._collect(future.result()) for future in current]
+                    yield from heapq.merge(*results, key=lambda page: page.timestamp)
+        finally:
+            log_listener.stop()
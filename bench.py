@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the page parsing hot path.
+
+Times PageParser.parse, the per-PSAP parse_page implementations,
+Page.to_json and the legacy process_line.process_line against fixed
+corpora and reports ns/op, memory blocks retained per op and peak traced
+memory.
+
+    ./bench.py -o before.json
+    ./bench.py -o after.json --compare before.json
+
+Logging is disabled while benchmarking so log handlers don't skew the
+numbers.
+"""
+import sys
+import gc
+import json
+import time
+import logging
+import argparse
+import platform
+import tracemalloc
+from functools import partial
+
+from PageParser import PageParser
+from PageParser import PageNorcom
+from PageParser import PageSnohomish
+
+TS = "2024-01-05 12:34:56"
+
+CORPUS_NORCOM = {
+    'well_formed': [
+        "<AID - Aid Response>; *FTAC - 3*;  BELLEVUE SQUARE; 575 BELLEVUE SQ, BELLEVUE; E71, M14, L1; 47.6154; -122.2010<EOT>",
+        "<FIRE - Commercial>; *FTAC - 11*;  ; 1200 112TH AVE NE, BELLEVUE; E1, E2, L3, BC14, MSO; 47.6201; -122.1887<EOT>",
+        "<MVC - Injury>; **;  I405 NB; I405 NB / NE 8TH ST, BELLEVUE; E71; 47.6172; -122.1890",
+    ],
+    'truncated': [
+        "<AID - Aid Response>; *FTAC - 3*;  BELLEVUE SQUARE; 575 BELLEVUE SQ",
+        "<FIRE - Commercial>; *FTAC - 11*;  ; 1200 112TH AVE NE, BELLEVUE; E1, E2, L3<EOT>",
+    ],
+    'keepalive': [
+        "NORCOM: PAGEGATE KEEP ALIVE NORMAL<EOT>",
+    ],
+    'malformed': [
+        "TEST PAGE FOR STATION 71 CREW<EOT>",
+        "<AID - Aid; *FTAC<EOT>",
+        ">>MED - Aid Call<< FIRE TAC 5 - Alarm Level: 1 1234 MAIN ST / SOME PLACE / F240012345 *E71, M14*<EOT>",
+    ],
+}
+
+CORPUS_SNOHOMISH = {
+    'well_formed': [
+        ">>MED - Aid Call<< FIRE TAC 5 - Alarm Level: 1 1234 MAIN ST / SOME PLACE / F240012345 *E71, M14* patient fell<EOT>",
+        ">>FIRE - Residential<< FIRE TAC 2 - Alarm Level: 2 99 OAK AVE / HOUSE / F240012346 *E71, E72, L7, B3* smoke showing<EOT>",
+        ">>MED - Aid Call<< 1234 MAIN ST / SOME PLACE / F240012347 *E71* <EOT>",
+    ],
+    'truncated': [
+        ">>FIRE - Residential<< FIRE TAC 2 - Alarm Level: 2 99 OAK AVE / HOUSE / F240012346 *E71, E72, L7, B3, M14, M15, E7<EOT>",
+        ">>FIRE - Residential<< FIRE TAC 2 - Alarm Level: 2 99 OAK AVE / HOUSE / F240012346 *E71, E72, L7, B3, M14, M15, E<EOT>",
+    ],
+    'keepalive': [
+        "SNO911: PAGEGATE KEEP ALIVE NORMAL<EOT>",
+    ],
+    'malformed': [
+        ">>MED - Aid Call<< broken<EOT>",
+        ">>MVC<< FIRE TAC 5 1 A ST / / *E1* x<EOT>",
+        "<AID - Aid Response>; *FTAC - 3*;  BELLEVUE SQUARE; 575 BELLEVUE SQ, BELLEVUE; E71; 47.6154; -122.2010<EOT>",
+    ],
+}
+
+CAPCODES = {'norcom': "1471234", 'snohomish': "1310001"}
+
+
+def build_lines():
+    """ Build full multimon-ng lines for each corpus category """
+    lines = {}
+    for category in CORPUS_NORCOM:
+        lines[category] = [
+            "{}: POCSAG1200: Address: {}  Function: 0  Alpha:   {}".format(TS, CAPCODES['norcom'], alpha)
+            for alpha in CORPUS_NORCOM[category]
+        ] + [
+            "{}: POCSAG1200: Address: {}  Function: 0  Alpha:   {}".format(TS, CAPCODES['snohomish'], alpha)
+            for alpha in CORPUS_SNOHOMISH[category]
+        ]
+    lines['malformed'] += [
+        "garbage line",
+        "{}: POCSAG512: Address: 1471236  Function: 0  Alpha:   x".format(TS),
+        "{}: POCSAG1200: Address: 2000002  Function: 0  Alpha:   UNKNOWN CAPCODE<EOT>".format(TS),
+    ]
+    return lines
+
+
+def legacy_line(line):
+    """ Convert a timestamped line into the format process_line expects """
+    _, sep, rest = line.partition(": POCSAG1200: ")
+    if not sep:
+        return line
+    address, _, alpha = rest.partition("  Function: 0  Alpha:   ")
+    return "POCSAG1200: {}  Function: 0  Alpha:   {}".format(address, alpha)
+
+
+def guarded(func):
+    """ Wrap func so exceptions from known-bad inputs count as a result """
+    def call(item):
+        try:
+            return func(item)
+        except (AttributeError, TypeError, ValueError, IndexError):
+            return None
+    return call
+
+
+def measure(func, inputs, number, repeat):
+    """
+    Time func over every input and return a result dict.
+
+    ns_per_op is the best of `repeat` runs. blocks_per_op counts the memory
+    blocks still alive after each call (results are kept referenced), and
+    peak_bytes is the tracemalloc peak for a single pass over the inputs.
+    """
+    ops = number * len(inputs)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            for item in inputs:
+                func(item)
+        elapsed = time.perf_counter_ns() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    results = [None] * len(inputs)
+    gc.collect()
+    gc.disable()
+    try:
+        blocks_before = sys.getallocatedblocks()
+        for index, item in enumerate(inputs):
+            results[index] = func(item)
+        blocks = sys.getallocatedblocks() - blocks_before
+    finally:
+        gc.enable()
+    del results
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        for item in inputs:
+            func(item)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'ops': ops,
+        'ns_per_op': best / ops,
+        'blocks_per_op': max(blocks, 0) / len(inputs),
+        'peak_bytes': peak - base,
+    }
+
+
+def parsed_fields(page):
+    """ Read a parsed field so a lazily parsed page does the work """
+    return page is not None and page.parsed
+
+
+def build_cases(lines):
+    """ Return a list of (name, func, inputs) benchmark cases """
+    import process_line
+
+    # The corpus repeats a few lines, so the parse cache would turn every
+    # pass after the first into cache hits; only the "cached" cases use it
+    parser = PageParser(cache_size=0)
+    cached_parser = PageParser()
+    cases = []
+
+    for category, items in lines.items():
+        cases.append(("PageParser.parse/{}".format(category), parser.parse, items))
+
+    # Fields are parsed on first access; this is the cost of a page that gets published
+    for category, items in lines.items():
+        cases.append(("PageParser.parse+fields/{}".format(category),
+                      lambda line: parsed_fields(parser.parse(line)), items))
+
+    # Copies of a recently parsed text, as when dispatch pages several capcodes
+    for category, items in lines.items():
+        cases.append(("PageParser.parse+fields/cached/{}".format(category),
+                      lambda line: parsed_fields(cached_parser.parse(line)), items))
+
+    for cls, corpus, capcode in ((PageNorcom, CORPUS_NORCOM, CAPCODES['norcom']),
+                                 (PageSnohomish, CORPUS_SNOHOMISH, CAPCODES['snohomish'])):
+        for category, alphas in corpus.items():
+            pages = [cls(raw=alpha, capcode=capcode, alpha=alpha, ts=TS) for alpha in alphas]
+            cases.append(("{}.parse_page/{}".format(cls.__name__, category),
+                          lambda page: page.parse_page(), pages))
+
+    parsed = [page for page in map(parser.parse, lines['well_formed'] + lines['keepalive']) if page is not None]
+    cases.append(("Page.to_json/well_formed", lambda page: page.to_json(), parsed))
+
+    for category, items in lines.items():
+        cases.append(("process_line.process_line/{}".format(category),
+                      guarded(partial(process_line.process_line, parser=parser)),
+                      [legacy_line(line) for line in items]))
+
+    return cases
+
+
+def compare(results, baseline):
+    """ Print the change in ns/op against a previous results file """
+    print("")
+    print("{:<45} {:>12} {:>12} {:>9}".format("case", "before ns", "after ns", "change"))
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        before = old['ns_per_op']
+        after = result['ns_per_op']
+        change = ((after - before) / before * 100) if before else 0.0
+        print("{:<45} {:>12.0f} {:>12.0f} {:>8.1f}%".format(name, before, after, change))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="NORCOM parser benchmarks")
+    argparser.add_argument('-n', '--number', type=int, default=500, help='Passes over the corpus per run')
+    argparser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per case (best is reported)')
+    argparser.add_argument('-k', '--filter', help='Only run cases containing this string')
+    argparser.add_argument('-o', '--output', help='Save results as JSON')
+    argparser.add_argument('-c', '--compare', help='Compare against a previous JSON results file')
+    args = argparser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    print("{:<45} {:>12} {:>10} {:>12}".format("case", "ns/op", "blocks/op", "peak bytes"))
+    for name, func, inputs in build_cases(build_lines()):
+        if args.filter and args.filter not in name:
+            continue
+        result = measure(func, inputs, args.number, args.repeat)
+        results[name] = result
+        print("{:<45} {:>12.0f} {:>10.1f} {:>12d}".format(
+            name, result['ns_per_op'], result['blocks_per_op'], result['peak_bytes']))
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'timestamp': int(time.time()),
+                'results': results,
+            }, fh, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as fh:
+            compare(results, json.load(fh)['results'])
+
+
+if __name__ == "__main__":
+    main()
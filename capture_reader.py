@@ -0,0 +1,179 @@
+"""
+Streaming reader for raw multimon-ng captures.
+
+The file is read through a sliding read-only mmap window of `window_bytes`,
+so memory use stays flat however large the capture is, and lines are
+sliced out of the mapping without going through a read buffer. Lines are
+yielded as (offset, bytes) with the offset of the line's first byte; the
+reader's `offset` is always the start of the next unread line, so it can
+be saved and passed back in to resume.
+
+With follow=True the reader keeps waiting for new lines at the end of the
+file, like tail -F: it reopens the path when the file is replaced (e.g.
+logrotate) and starts over if the file is truncated. An unterminated last
+line is held back until its newline arrives.
+
+    with CaptureReader("/app/raw", follow=True) as reader:
+        for offset, line in reader.lines():
+            ...
+
+poll_lines() reads a pipe such as stdin instead, waking up every so often
+when nothing arrives.
+"""
+import os
+import mmap
+import time
+import select
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bytes of the mapping split into lines at once
+SLICE_BYTES = 256 * 1024
+
+# Bytes read from a pipe at once
+PIPE_READ_BYTES = 64 * 1024
+
+
+def poll_lines(stream, timeout):
+    """
+    Yield decoded lines from a pipe or file until EOF, and None whenever
+    `timeout` seconds pass with no complete line, so the caller can run
+    timers while the input is silent.
+    """
+    fd = stream.fileno()
+    pending = b""
+    while True:
+        ready, _, _ = select.select([fd], [], [], timeout)
+        if not ready:
+            yield None
+            continue
+
+        data = os.read(fd, PIPE_READ_BYTES)
+        if not data:
+            if pending:
+                yield pending.decode('utf-8', errors='replace')
+            return
+
+        pending += data
+        if b"\n" not in data:
+            continue
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode('utf-8', errors='replace') + "\n"
+
+
+class CaptureReader:
+
+    def __init__(self, path, offset=0, follow=False, poll_interval=0.5, window_bytes=16 * 1024 * 1024):
+        self.path = os.path.expanduser(path)
+        self.offset = offset
+        self.follow = follow
+        self.poll_interval = poll_interval
+        # Windows start on an allocation boundary, so make the size a multiple of it
+        self.window_bytes = max(window_bytes - window_bytes % mmap.ALLOCATIONGRANULARITY, mmap.ALLOCATIONGRANULARITY)
+
+        self._fh = open(self.path, 'rb')
+        self.stopped = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return self.lines()
+
+    def seek(self, offset):
+        self.offset = offset
+
+    def stop(self):
+        """ Make a follow-mode lines() return at its next poll """
+        self.stopped = True
+
+    def close(self):
+        self._fh.close()
+
+    def _read_window(self, size):
+        """ Yield the complete lines in one mmap window starting at self.offset """
+        base = self.offset - self.offset % mmap.ALLOCATIONGRANULARITY
+        window = self.window_bytes
+        while True:
+            length = min(size - base, window)
+            with mmap.mmap(self._fh.fileno(), length, access=mmap.ACCESS_READ, offset=base) as view:
+                pos = self.offset - base
+                found = False
+                # Split a slice at a time rather than searching line by line
+                while pos < length:
+                    last = view.rfind(b"\n", pos, min(pos + SLICE_BYTES, length))
+                    if last < 0:
+                        last = view.find(b"\n", pos + SLICE_BYTES, length)
+                        if last < 0:
+                            break
+                    found = True
+                    offset = base + pos
+                    for line in view[pos:last].split(b"\n"):
+                        line += b"\n"
+                        self.offset = offset + len(line)
+                        yield offset, line
+                        offset = self.offset
+                    pos = last + 1
+
+            if found or base + length >= size:
+                return
+            # A line longer than the window, map a bigger one
+            window *= 2
+
+    def lines(self, end=None):
+        """
+        Yield (offset, line) from the current offset up to `end` (a line
+        boundary), or to the end of the file. Follow mode only applies
+        when no end is given.
+        """
+        follow = self.follow and end is None
+
+        while not self.stopped:
+            size = os.fstat(self._fh.fileno()).st_size
+            if end is not None:
+                size = min(size, end)
+
+            if size < self.offset:
+                if not follow:
+                    return
+                logger.warning("%s was truncated, reading from the start", self.path)
+                self.offset = 0
+
+            if self.offset < size:
+                start = self.offset
+                yield from self._read_window(size)
+                if self.offset != start:
+                    continue
+
+            # No complete line left
+            if not follow:
+                if self.offset < size:
+                    # Unterminated last line
+                    self._fh.seek(self.offset)
+                    line = self._fh.read(size - self.offset)
+                    self.offset = size
+                    yield self.offset - len(line), line
+                return
+
+            if self._replaced():
+                logger.info("%s was replaced, reopening", self.path)
+                self._fh.close()
+                self._fh = open(self.path, 'rb')
+                self.offset = 0
+                continue
+
+            time.sleep(self.poll_interval)
+
+    def _replaced(self):
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            # Mid-rotation; keep reading the old file until the new one shows up
+            return False
+        opened = os.fstat(self._fh.fileno())
+        return (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino)
@@ -0,0 +1,152 @@
+"""
+Cross-capcode deduplication for published pages.
+
+Dispatch sends the same page to several capcodes and multimon-ng decodes
+each copy. Pages are keyed on a hash of their normalized alpha text; the
+first copy is held for `hold` seconds to collect the capcodes of the
+copies that follow, then emitted once with the full capcode list. Copies
+arriving after that, within `ttl` seconds of the first one, are dropped.
+
+With hold=0 the first copy goes out straight away with only its own
+capcode, and later copies are dropped.
+
+Entries live in an insertion-ordered dict, so expiring them is a pop from
+the front; the dict is also capped at `max_entries`.
+"""
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def dedup_key(alpha):
+    """ Hash of the page text without the <EOT>/<NUL> markers and extra whitespace """
+    text = " ".join(alpha.replace("<EOT>", "").replace("<NUL>", "").split())
+    return hashlib.blake2b(text.encode('utf-8', errors='replace'), digest_size=8).digest()
+
+
+class DedupEntry:
+    __slots__ = ('first_seen', 'capcodes', 'item', 'emitted')
+
+    def __init__(self, first_seen, capcode, item):
+        self.first_seen = first_seen
+        self.capcodes = [capcode]
+        self.item = item
+        self.emitted = False
+
+
+class DedupCache:
+    """
+    emit(item, capcodes) is called once per distinct page, from the
+    cache's own thread when hold > 0.
+    """
+
+    def __init__(self, emit, ttl=30.0, hold=1.5, max_entries=4096):
+        self.emit = emit
+        self.ttl = max(ttl, hold)
+        self.hold = hold
+        self.max_entries = max_entries
+
+        self.counters = {'unique': 0, 'duplicates': 0, 'evicted': 0}
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        self._thread = None
+        if self.hold > 0:
+            self._thread = threading.Thread(target=self._release, name="dedup", daemon=True)
+            self._thread.start()
+
+    def offer(self, alpha, capcode, item):
+        """
+        Offer a page for publishing. Returns True if the caller should
+        publish it now (only ever with hold=0), otherwise the cache has
+        either taken it or recognised it as a duplicate.
+        """
+        key = dedup_key(alpha)
+        now = time.monotonic()
+        evicted = []
+
+        with self._lock:
+            self._expire(now, evicted)
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.counters['duplicates'] += 1
+                if capcode not in entry.capcodes:
+                    entry.capcodes.append(capcode)
+                logger.debug("Duplicate page to %s, first seen on %s", capcode, entry.capcodes[0])
+                publish = False
+            else:
+                self.counters['unique'] += 1
+                entry = DedupEntry(now, capcode, item)
+                self._entries[key] = entry
+                if len(self._entries) > self.max_entries:
+                    self._pop_oldest(evicted)
+
+                if self.hold > 0:
+                    publish = False
+                else:
+                    self._take(entry)
+                    publish = True
+
+        self._emit_all(evicted)
+        return publish
+
+    def _expire(self, now, evicted):
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.first_seen < self.ttl:
+                break
+            self._pop_oldest(evicted)
+
+    def _pop_oldest(self, evicted):
+        _, entry = self._entries.popitem(last=False)
+        if not entry.emitted:
+            # Only happens when max_entries is too small for the hold time
+            self.counters['evicted'] += 1
+            evicted.append(self._take(entry))
+
+    def _take(self, entry):
+        """ Mark an entry as emitted, returns (item, capcodes) to emit. Call with the lock held. """
+        entry.emitted = True
+        item, entry.item = entry.item, None
+        return item, list(entry.capcodes)
+
+    def _emit_all(self, pending):
+        for item, capcodes in pending:
+            try:
+                self.emit(item, capcodes)
+            except Exception:
+                logger.exception("Failed to publish deduplicated page")
+
+    def _release(self):
+        while not self._closed:
+            self._wake.wait(self.hold / 4)
+            self._wake.clear()
+            due = []
+            with self._lock:
+                now = time.monotonic()
+                for entry in self._entries.values():
+                    if now - entry.first_seen < self.hold:
+                        break
+                    if not entry.emitted:
+                        due.append(self._take(entry))
+            self._emit_all(due)
+
+    def close(self):
+        """ Emit anything still held and stop the release thread """
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        with self._lock:
+            held = [self._take(entry) for entry in self._entries.values() if not entry.emitted]
+        self._emit_all(held)
+        logger.info("Dedup: %d unique pages, %d duplicates dropped",
+                    self.counters['unique'], self.counters['duplicates'])
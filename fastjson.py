@@ -0,0 +1,41 @@
+"""
+Serialise the flat page models to JSON without building intermediate dicts.
+
+Output is identical to json.dumps() with default arguments. Strings go
+through the C-accelerated encode_basestring_ascii, so the result is always
+ASCII and can be encoded to bytes without a UTF-8 pass. Anything that
+isn't a str, int, float, None, list or str-keyed dict falls back to
+json.dumps().
+"""
+import json
+from json.encoder import encode_basestring_ascii as quote
+
+_INFINITY = float('inf')
+
+
+def dumps_value(value):
+    """ Return the JSON text for a single value """
+    cls = value.__class__
+    if cls is str:
+        return quote(value)
+    if value is None:
+        return 'null'
+    if cls is int:
+        return int.__repr__(value)
+    if cls is float and value == value and value != _INFINITY and value != -_INFINITY:
+        return float.__repr__(value)
+    if cls is list:
+        return '[' + ', '.join([dumps_value(item) for item in value]) + ']'
+    if cls is dict and all(key.__class__ is str for key in value):
+        return dumps_items(value.items())
+    return json.dumps(value)
+
+
+def dumps_items(items):
+    """ Return the JSON object text for an iterable of (str key, value) pairs """
+    return '{' + ', '.join([quote(key) + ': ' + dumps_value(value) for key, value in items]) + '}'
+
+
+def dumps_dict_bytes(data):
+    """ Equivalent to json.dumps(data).encode() """
+    return dumps_value(data).encode('ascii')
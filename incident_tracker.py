@@ -0,0 +1,159 @@
+"""
+In-memory incident table keyed on the CAD reference (call_id).
+
+Pages for the same incident are merged into one state record: units are
+accumulated, the alarm level only goes up, and the latest non-empty call
+type, location and notes win. Each update returns the merged state and a
+delta describing what changed (new incident, units added, alarm raised),
+or no delta if the page added nothing.
+
+Incidents expire `ttl` seconds after their last page. The table can be
+saved to a JSON file (at most every `save_interval` seconds and on close)
+and is reloaded from it on startup.
+"""
+import os
+import copy
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def alarm_rank(level):
+    """ Numeric alarm level for comparisons, None if it isn't a number """
+    try:
+        return int(level)
+    except (TypeError, ValueError):
+        return None
+
+
+class IncidentTracker:
+
+    def __init__(self, ttl=6 * 3600, path=None, save_interval=30):
+        self.ttl = ttl
+        self.path = os.path.expanduser(path) if path else None
+        self.save_interval = save_interval
+
+        self.incidents = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+        if self.path and os.path.exists(self.path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as fh:
+                incidents = json.load(fh)
+        except (OSError, ValueError) as err:
+            logger.error("Failed to load incident state from %s: %s", self.path, err)
+            return
+        self.incidents = {state['reference']: state for state in incidents}
+        logger.info("Loaded %d incidents from %s", len(self.incidents), self.path)
+
+    def update(self, page, capcodes=None):
+        """
+        Merge a parsed page into its incident. Returns (state, delta); state
+        is None if the page has no call_id, delta is None if nothing changed.
+        The returned state is a copy and safe to publish.
+        """
+        if not page.call_id:
+            return None, None
+
+        with self._lock:
+            state = self.incidents.get(page.call_id)
+            delta = {'reference': page.call_id, 'timestamp': page.timestamp}
+
+            if state is None:
+                state = {
+                    'reference': page.call_id,
+                    'psap': str(page.psap),
+                    'first_seen': page.timestamp,
+                    'last_seen': page.timestamp,
+                    'pages': 0,
+                    'incident': {'type': None, 'subtype': None},
+                    'alarm_level': None,
+                    'channel': None,
+                    'units': [],
+                    'location': {'name': None, 'address': None, 'geo': {}},
+                    'cad_notes': None,
+                    'capcodes': [],
+                }
+                self.incidents[page.call_id] = state
+                delta['new'] = True
+
+            state['pages'] += 1
+            state['first_seen'] = min(state['first_seen'], page.timestamp)
+            state['last_seen'] = max(state['last_seen'], page.timestamp)
+
+            if page.call_type:
+                state['incident'] = {'type': page.call_type, 'subtype': page.call_subtype}
+            if page.channel:
+                state['channel'] = page.channel
+            if page.address_raw:
+                state['location'] = {'name': page.address_name, 'address': page.address_raw, 'geo': dict(page.geo or {})}
+            if page.call_notes:
+                state['cad_notes'] = page.call_notes
+
+            for capcode in capcodes or [page.capcode]:
+                if capcode not in state['capcodes']:
+                    state['capcodes'].append(capcode)
+
+            added = [unit for unit in page.units if unit not in state['units']]
+            if added:
+                state['units'].extend(added)
+                delta['units_added'] = added
+
+            old_rank = alarm_rank(state['alarm_level'])
+            new_rank = alarm_rank(page.alarm_level)
+            if new_rank is not None and (old_rank is None or new_rank > old_rank):
+                if old_rank is not None:
+                    delta['alarm_level'] = {'from': state['alarm_level'], 'to': page.alarm_level}
+                state['alarm_level'] = page.alarm_level
+
+            self._dirty = True
+            snapshot = copy.deepcopy(state)
+            if len(delta) == 2:
+                # Only reference and timestamp, nothing changed
+                delta = None
+
+        self.save(force=False)
+        return snapshot, delta
+
+    def expire(self, now=None):
+        """ Drop incidents with no pages for ttl seconds, returns their states """
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [state for state in self.incidents.values() if now - state['last_seen'] >= self.ttl]
+            for state in expired:
+                del self.incidents[state['reference']]
+            if expired:
+                self._dirty = True
+        return expired
+
+    def save(self, force=True):
+        """ Write the table to disk if it changed (and save_interval has passed unless forced) """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            if not force and time.monotonic() - self._saved_at < self.save_interval:
+                return
+            data = json.dumps(list(self.incidents.values()))
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as fh:
+                fh.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            logger.error("Failed to save incident state to %s: %s", self.path, err)
+
+    def close(self):
+        self.save()
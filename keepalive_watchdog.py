@@ -0,0 +1,93 @@
+"""
+Pagegate keepalive watchdog.
+
+PageGate sends a keepalive page every `interval` seconds. The watchdog
+records when the last one arrived and check() (called on a timer, not per
+input line, so a silent input is still noticed) works out the health state:
+
+    ok       a keepalive arrived within the last interval
+    missed   one or more intervals passed without one
+    dead     `missed` intervals passed without one (never, if missed is 0)
+
+on_health(health) is called with a health dict whenever the state or the
+number of missed keepalives changes, and check() returns False once the
+state is dead. Detection takes at most interval * missed plus the time
+between checks.
+"""
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+OK = 'ok'
+MISSED = 'missed'
+DEAD = 'dead'
+
+
+class KeepaliveWatchdog:
+
+    def __init__(self, interval=120, missed=3, on_health=None):
+        self.interval = interval
+        self.missed = missed
+        self.on_health = on_health
+
+        self.state = OK
+        self.missed_count = 0
+        # Receive times rather than page timestamps, so a skewed multimon clock doesn't matter
+        self.last_received = time.monotonic()
+        self.last_received_wall = None
+
+    def received(self):
+        """ A keepalive page arrived """
+        self.last_received = time.monotonic()
+        self.last_received_wall = time.time()
+        if self.state != OK:
+            logger.info("Keepalive received after %d missed", self.missed_count)
+        self._update(OK, 0)
+
+    def health(self, now=None):
+        silence = (now if now is not None else time.monotonic()) - self.last_received
+        return {
+            'state': self.state,
+            'missed': self.missed_count,
+            'silence': round(silence, 1),
+            'interval': self.interval,
+            'last_keepalive': self.last_received_wall,
+            'timestamp': int(time.time()),
+        }
+
+    def check(self, now=None):
+        """ Update the health state; returns False once too many keepalives were missed """
+        now = now if now is not None else time.monotonic()
+        missed = int((now - self.last_received) // self.interval)
+
+        if missed == 0:
+            state = OK
+        elif self.missed > 0 and missed >= self.missed:
+            state = DEAD
+        else:
+            state = MISSED
+
+        if missed > self.missed_count:
+            logger.info("No keepalive received for %d seconds", missed * self.interval)
+            if state == DEAD and self.state != DEAD:
+                logger.error("Too many missed keepalives, I'm giving up.")
+
+        self._update(state, missed, now)
+        return state != DEAD
+
+    def _update(self, state, missed, now=None):
+        if state == self.state and missed == self.missed_count:
+            return
+        self.state = state
+        self.missed_count = missed
+        self.publish(now)
+
+    def publish(self, now=None):
+        """ Report the current health to on_health """
+        if self.on_health is None:
+            return
+        try:
+            self.on_health(self.health(now))
+        except Exception:
+            logger.exception("Failed to report keepalive health")
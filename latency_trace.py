@@ -0,0 +1,239 @@
+"""
+End-to-end latency tracing for published pages.
+
+Each traced page records when multimon-ng decoded it (the timestamp on the
+input line), when parsing started and finished, when the MQTT message was
+handed to the client, and when the broker acknowledged it (paho's
+on_publish for the message's mid). Traced messages must be published at
+QoS 1 or higher: at QoS 0 paho calls on_publish as soon as the message is
+written to the socket, so "ack" would not include the broker. A finished
+trace is broken into spans:
+
+    decode  line timestamp -> parse start (pipe and read buffering)
+    parse   parse start -> parse end
+    queue   parse end -> client.publish() (routing, pipeline queue, dedup hold)
+    ack     client.publish() -> on_publish (broker PUBACK round trip)
+    total   line timestamp -> on_publish
+
+multimon-ng timestamps have one second resolution, so decode and total
+carry up to a second of rounding; the other spans are measured with
+perf_counter. Messages the outbox is holding back have no mid yet and
+finish as "queued" without ack/total; ones never acknowledged within
+`ack_timeout` seconds finish as "timeout".
+
+Spans are written one compact JSON object per line to `span_file` (or
+logged at debug level), and the last `window` traces per PSAP and call type
+are kept for p50/p95/p99 rollups.
+"""
+import json
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from PageParser import PageKind
+
+logger = logging.getLogger(__name__)
+
+SPANS = ('decode', 'parse', 'queue', 'ack', 'total')
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(values, q):
+    """ Nearest-rank percentile of a sorted list """
+    if not values:
+        return None
+    rank = max(math.ceil(q * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def trace_call_type(page):
+    """ Rollup key for a page's call type """
+    if page.kind == PageKind.KEEPALIVE:
+        return "keepalive"
+    # Only incident pages are parsed for their call type
+    if page.kind == PageKind.INCIDENT and page.parsed:
+        return page.call_type or "unknown"
+    return "text"
+
+
+class PageTrace:
+    __slots__ = ('psap', 'call_type', 'capcode', 'decoded', 'wall_start',
+                 'parse_start', 'parse_end', 'enqueued', 'acked', 'mid', 'outcome')
+
+    def __init__(self, page, parse_start, parse_end, wall_start):
+        self.psap = str(page.psap)
+        self.call_type = trace_call_type(page)
+        self.capcode = page.capcode
+        self.decoded = page.timestamp
+        # time.time() at parse_start, to line the perf_counter marks up with the decode time
+        self.wall_start = wall_start
+        self.parse_start = parse_start
+        self.parse_end = parse_end
+        self.enqueued = None
+        self.acked = None
+        self.mid = None
+        self.outcome = None
+
+    def spans(self):
+        """ Span name -> seconds for the parts of the trace that completed """
+        spans = {
+            'decode': self.wall_start - self.decoded,
+            'parse': self.parse_end - self.parse_start,
+        }
+        if self.enqueued is not None:
+            spans['queue'] = self.enqueued - self.parse_end
+        if self.acked is not None:
+            spans['ack'] = self.acked - self.enqueued
+            spans['total'] = spans['decode'] + (self.acked - self.parse_start)
+        return spans
+
+    def to_json(self):
+        record = {
+            'ts': self.decoded,
+            'psap': self.psap,
+            'call_type': self.call_type,
+            'capcode': self.capcode,
+            'mid': self.mid,
+            'outcome': self.outcome,
+        }
+        for span, seconds in self.spans().items():
+            record[span + '_ms'] = round(seconds * 1000, 3)
+        return json.dumps(record, separators=(',', ':'))
+
+
+class LatencyTracer:
+    """
+    begin() a trace when a page is parsed, then published() with the paho
+    MQTTMessageInfo (or None) once it has been handed to the client, and
+    ack(mid) from on_publish.
+    """
+
+    def __init__(self, window=1000, span_file=None, ack_timeout=30.0):
+        self.window = window
+        self.ack_timeout = ack_timeout
+
+        # (psap, call_type) -> deque of span dicts
+        self.samples = {}
+        self.counters = {'acked': 0, 'queued': 0, 'timeout': 0, 'error': 0}
+
+        # mid -> trace waiting for its PUBACK, in publish order
+        self._pending = OrderedDict()
+        # mid -> perf_counter for acks that arrived before published() did
+        self._early_acks = {}
+        self._lock = threading.Lock()
+
+        self._fh = open(span_file, 'a', buffering=1) if span_file else None
+
+    def begin(self, page, parse_start, parse_end):
+        """ Start a trace for a parsed page; parse_start/end are perf_counter values """
+        wall_start = time.time() - (time.perf_counter() - parse_start)
+        return PageTrace(page, parse_start, parse_end, wall_start)
+
+    def published(self, trace, info):
+        """ The page's message was handed to the client (info is None if it wasn't sent) """
+        now = time.perf_counter()
+        trace.enqueued = now
+
+        with self._lock:
+            self._expire(now)
+
+            if info is None or info.rc != 0:
+                trace.outcome = 'queued' if info is None else 'error'
+                self._finish(trace)
+                return
+
+            trace.mid = info.mid
+            acked = self._early_acks.pop(info.mid, None)
+            if acked is not None:
+                trace.acked = max(acked, now)
+                trace.outcome = 'acked'
+                self._finish(trace)
+            else:
+                self._pending[info.mid] = trace
+
+    def ack(self, mid):
+        """ on_publish callback """
+        now = time.perf_counter()
+        with self._lock:
+            trace = self._pending.pop(mid, None)
+            if trace is None:
+                # on_publish can run before publish() has returned the mid
+                self._early_acks[mid] = now
+                return
+            trace.acked = now
+            trace.outcome = 'acked'
+            self._finish(trace)
+
+    def _expire(self, now):
+        """ Finish traces that were never acknowledged. Call with the lock held. """
+        while self._pending:
+            mid, trace = next(iter(self._pending.items()))
+            if now - trace.enqueued < self.ack_timeout:
+                break
+            del self._pending[mid]
+            trace.outcome = 'timeout'
+            self._finish(trace)
+
+        # Acks for mids that aren't ours (outbox drains, metrics snapshots)
+        expired = now - self.ack_timeout
+        for mid in [mid for mid, seen in self._early_acks.items() if seen < expired]:
+            del self._early_acks[mid]
+
+    def _finish(self, trace):
+        """ Record a finished trace. Call with the lock held. """
+        self.counters[trace.outcome] += 1
+        key = (trace.psap, trace.call_type)
+        samples = self.samples.get(key)
+        if samples is None:
+            samples = self.samples[key] = deque(maxlen=self.window)
+        samples.append(trace.spans())
+
+        line = trace.to_json()
+        if self._fh is not None:
+            try:
+                self._fh.write(line + "\n")
+            except OSError as err:
+                logger.error("Failed to write latency trace: %s", err)
+        else:
+            logger.debug("Trace %s", line)
+
+    def percentiles(self):
+        """ Return {(psap, call_type): {span: (count, p50, p95, p99)}} over the recent window """
+        with self._lock:
+            snapshot = {key: list(samples) for key, samples in self.samples.items()}
+
+        rollup = {}
+        for key, samples in snapshot.items():
+            spans = {}
+            for span in SPANS:
+                values = sorted(sample[span] for sample in samples if span in sample)
+                if values:
+                    spans[span] = (len(values),) + tuple(percentile(values, q) for q in QUANTILES)
+            rollup[key] = spans
+        return rollup
+
+    def summary(self):
+        """ Return printable rollup lines """
+        lines = ["  {:<8} {:<24} {:<7} {:>7} {:>10} {:>10} {:>10}".format(
+            "psap", "call type", "span", "count", "p50 ms", "p95 ms", "p99 ms")]
+        for (psap, call_type), spans in sorted(self.percentiles().items()):
+            for span in SPANS:
+                if span not in spans:
+                    continue
+                count, p50, p95, p99 = spans[span]
+                lines.append("  {:<8} {:<24} {:<7} {:>7} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                    psap, call_type[:24], span, count, p50 * 1000, p95 * 1000, p99 * 1000))
+        return lines
+
+    def close(self, wait=2.0):
+        """ Wait up to `wait` seconds for outstanding acks, then finish the rest as timeouts """
+        deadline = time.monotonic() + wait
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self._lock:
+            self._expire(float('inf'))
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 from process_line import process_line
-import json
+import sys
+import coloredlogs
+
+coloredlogs.install(fmt="%(asctime)s - %(levelname)s - %(message)s")
 
 while True:
     line = input()
     page = process_line(line)
     if page:
-        print(json.dumps(page.__dict__))
+        sys.stdout.buffer.write(page.to_json_bytes() + b"\n")
+        sys.stdout.flush()
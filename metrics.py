@@ -0,0 +1,254 @@
+"""
+Prometheus text-format metrics without third party dependencies.
+
+A Registry holds counters, gauges and histograms (optionally labelled) and
+renders them in the Prometheus exposition format. serve() exposes a
+registry on /metrics from a background HTTP server thread; callbacks
+registered with Registry.on_collect() run before each render so gauges
+like queue depths are sampled when scraped.
+
+PagerMetrics is the set of metrics norcom_pager reports.
+"""
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PageParser import PageKind
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; parse times are in the tens of microseconds, publishes and writes
+# in the milliseconds
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                   0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, escape_label(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(*extra))
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("{} expects labels {}".format(self.name, self.labelnames))
+        return tuple(str(value) for value in labels)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(self._render_values(items))
+        return lines
+
+    def _render_values(self, items):
+        for labels, value in items:
+            yield "{}{} {}".format(self.name, format_labels(self.labelnames, labels), format_value(value))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (not cumulative), sum, count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_values(self, items):
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield "{}_bucket{} {}".format(
+                    self.name, format_labels(self.labelnames, labels, ('le', format_value(bound))), cumulative)
+            suffix = format_labels(self.labelnames, labels)
+            yield "{}_sum{} {}".format(self.name, suffix, format_value(total))
+            yield "{}_count{} {}".format(self.name, suffix, count)
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def on_collect(self, callback):
+        """ Run callback() before every render, e.g. to sample gauges """
+        self._collectors.append(callback)
+
+    def render(self):
+        for callback in self._collectors:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Metrics collector failed")
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def serve(registry, host="127.0.0.1", port=9108):
+    """ Serve registry.render() on http://host:port/metrics from a daemon thread """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def run_every(interval, callback, name="metrics-snapshot"):
+    """ Call callback() every interval seconds on a daemon thread """
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                callback()
+            except Exception:
+                logger.exception("Periodic metrics callback failed")
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+class PagerMetrics(Registry):
+    """ Metrics for the page collector; also a StageTimer observer """
+
+    def __init__(self):
+        super().__init__()
+        self.lines = self.counter("pager_lines_read_total", "Input lines read")
+        self.pages = self.counter("pager_pages_total", "Pages matched by the parser", ("psap",))
+        self.parsed = self.counter("pager_pages_parsed_total", "Pages parsed as incidents", ("psap",))
+        self.skipped = self.counter("pager_pages_skipped_total", "Pages skipped by the parser", ("psap", "reason"))
+        self.unparsed = self.counter("pager_pages_unparsed_total", "Pages that failed to parse", ("psap",))
+        self.keepalives = self.counter("pager_keepalives_total", "Pagegate keepalive pages", ("psap",))
+        self.publishes = self.counter("pager_mqtt_publish_total", "MQTT publish attempts by result", ("result",))
+        self.queue_depth = self.gauge("pager_queue_depth", "Items waiting in each queue", ("queue",))
+        self.parse_seconds = self.histogram("pager_parse_seconds", "Time to parse one input line")
+        self.publish_seconds = self.histogram("pager_publish_seconds", "Time to hand one page to the MQTT client")
+        self.write_seconds = self.histogram("pager_write_seconds", "Time to write one page", ("writer",))
+        self.latency = self.gauge("pager_latency_seconds", "Recent page latency percentiles by span",
+                                  ("psap", "call_type", "span", "quantile"))
+
+    def page(self, page):
+        psap = str(page.psap)
+        self.pages.inc(psap)
+        # Count on the classification, so only incident pages get parsed here
+        if page.kind == PageKind.INCIDENT:
+            if page.parsed:
+                self.parsed.inc(psap)
+            else:
+                self.skipped.inc(psap, page.skip_reason)
+        elif page.kind == PageKind.KEEPALIVE:
+            self.keepalives.inc(psap)
+        elif page.alpha is None or page.grammar is None:
+            # Discarded without parsing (see Page.parse_page)
+            self.unparsed.inc(psap)
+        else:
+            self.skipped.inc(psap, "malformed")
+
+    def publish(self, result):
+        self.publishes.inc(result)
+
+    def latency_percentiles(self, rollup, quantiles):
+        """ Set the latency gauges from LatencyTracer.percentiles() """
+        for (psap, call_type), spans in rollup.items():
+            for span, (_, *values) in spans.items():
+                for quantile, value in zip(quantiles, values):
+                    self.latency.set(value, psap, call_type, span, format_value(quantile))
+
+    def observe_stage(self, stage, elapsed):
+        """ StageTimer hook: route stage timings to the matching histogram """
+        if stage == 'parse':
+            self.parse_seconds.observe(elapsed)
+        elif stage == 'publish':
+            self.publish_seconds.observe(elapsed)
+        elif stage != 'read':
+            self.write_seconds.observe(elapsed, stage)
@@ -5,28 +5,67 @@ import sys
 import random
 import logging
 import argparse
-import json
+import atexit
 import time
-# import re
+import re
 import ssl
+import sqlite3
+import threading
+from functools import partial
 
 import paho.mqtt.client as mqtt
 
+import payload_codec
+from pipeline import AsyncPipeline
+from outbox import Outbox
+from output_writer import OutputWriter
+from sqlite_store import SQLiteStore
+from archive_index import IndexedArchive, RawArchive, parse_time_arg
+from capture_reader import CaptureReader, poll_lines
+import metrics
+from dedup import DedupCache
+from backfill import Backfill
+from incident_tracker import IncidentTracker
+from latency_trace import LatencyTracer, QUANTILES
+from keepalive_watchdog import KeepaliveWatchdog
+from fastjson import dumps_value
+from queued_logging import start_queued_logging, RateLimitFilter
+
 # import settings
 from settings import Settings
 
 # Create a settings instance so code below can access configured values
 settings = Settings()
-print(settings)
 
 from PageParser import PageParser
 from PageParser import PagePSAP
+from PageParser import PageKind
+from PageParser import parse_timestamp
 
 logger = logging.getLogger(__name__)
 
+# Durable outbox for MQTT messages, set up in main() if MQTT_OUTBOX is set
+mqtt_outbox = None
+
+# Cross-capcode dedup for published pages, set up in main() if MQTT_DEDUP_TTL is set
+page_dedup = None
+
+# Merged per-incident state, set up in main() if INCIDENT_TRACKING is set
+incident_tracker = None
+
+# Prometheus metrics, set up in main() if METRICS_PORT or METRICS_MQTT_TOPIC is set
+pager_metrics = None
+
+# Per-page latency tracing, set up in main() for live input if LATENCY_TRACING is set
+latency_tracer = None
+
 def mqtt_on_publish(client, userdata, mid):
     """ Callback for mqtt client publish() """
     logger.debug("[MQTT] Published message id %d", mid)
+    if mqtt_outbox is not None:
+        mqtt_outbox.ack(mid)
+    if latency_tracer is not None:
+        latency_tracer.ack(mid)
 
 def mqtt_on_log(client, userdata, level, buf):
     """ Callback for mqtt client logging """
@@ -35,61 +74,173 @@ def mqtt_on_log(client, userdata, level, buf):
 def mqtt_on_disconnect(client, userdata, rc):
     """ Client for mqtt dicsconnects """
     logger.info("MQTT client disconnected")
+    if mqtt_outbox is not None:
+        mqtt_outbox.on_disconnect()
 
 
 def mqtt_safe_publish(mqtt_client, topic, payload, qos=0, retain=False):
     """Publish with SSL/OSError handling. Returns publish result or None on error."""
     try:
-        res = mqtt_client.publish(topic=topic, payload=payload, qos=qos, retain=retain)
+        if mqtt_outbox is not None:
+            # Persisted first; returns None if it's waiting behind the backlog
+            res = mqtt_outbox.publish(topic, payload, qos=qos, retain=retain)
+            result = 'queued' if res is None else 'ok'
+        else:
+            res = mqtt_client.publish(topic=topic, payload=payload, qos=qos, retain=retain)
+            result = 'ok' if res.rc == mqtt.MQTT_ERR_SUCCESS else 'error'
+        if pager_metrics is not None:
+            pager_metrics.publish(result)
         return res
     except ssl.SSLError as err:
         logger.error("MQTT TLS error while publishing to %s: %s", topic, err)
-        return None
     except OSError as err:
         logger.error("MQTT network error while publishing to %s: %s", topic, err)
-        return None
 
-def publish_page(data, mqtt_client):
+    if pager_metrics is not None:
+        pager_metrics.publish('error')
+    return None
+
+def payload_format(family):
+    """ Return the configured payload format for a topic family """
+    return settings.MQTT_PAYLOAD_FORMATS.get(family, settings.MQTT_PAYLOAD_FORMAT).lower()
+
+def encode_payload(family, topic, data):
+    """ Encode message data for a topic family, returns (topic, payload) """
+    name = payload_format(family)
+    return payload_codec.codec_topic(topic, name), payload_codec.get_codec(name)(data)
+
+def publish_page(data, mqtt_client, capcodes=None, trace=None):
     """ Publish unparsed page text to mqtt broker """
 
+    if capcodes is not None:
+        data = dict(data, capcodes=capcodes)
+
     topic = "page/text/{}".format(data['psap'].lower())
+    topic, message = encode_payload('text', topic, data)
 
     logger.info("Publishing page to MQTT topic %s", topic)
 
-    message = json.dumps(data)
-
-    res = mqtt_safe_publish(mqtt_client, topic, message.encode('utf-8'))
+    # Traced messages go out at QoS 1: paho's on_publish only means the
+    # broker acknowledged the message at QoS 1, at QoS 0 it's the socket write
+    res = mqtt_safe_publish(mqtt_client, topic, message, qos=1 if trace is not None else 0)
     if res is not None:
         logger.debug("Message %d queued for publishing", res.mid)
+    if trace is not None:
+        latency_tracer.published(trace, res)
 
 
-def publish_incident(page, mqtt_client):
-    """ Publish the parsed page to mqtt broker """
+def publish_incident(page, mqtt_client, capcodes=None, trace=None):
+    """
+    Publish the parsed page to mqtt broker. capcodes, if given, lists every
+    capcode the page was sent to and is added to the payload. trace, if
+    given, is the page's latency trace.
+    """
 
-    if page.keepalive:
+    if page.kind == PageKind.KEEPALIVE:
+        family = 'keepalive'
         topic = "page/pagegate_keepalive"
     else:
+        family = 'incident'
         topic = "page/{}/{}".format(
             str(page.psap).lower(),
             str(page.call_type).replace(" ", "_").replace("/", "_").lower()
         )
 
-    logger.info("Publishing incident to MQTT topic %s", topic)
+    name = payload_format(family)
+    if name == 'json':
+        message = page.to_json_bytes()
+        if capcodes is not None:
+            message = message[:-1] + ', "capcodes": {}}}'.format(dumps_value(capcodes)).encode('utf-8')
+    else:
+        data = page.to_dict()
+        if capcodes is not None:
+            data['capcodes'] = capcodes
+        message = payload_codec.get_codec(name)(data)
+    topic = payload_codec.codec_topic(topic, name)
 
-    message = page.to_json()
+    logger.info("Publishing incident to MQTT topic %s", topic)
 
-    res = mqtt_safe_publish(mqtt_client, topic, message.encode('utf-8'))
+    res = mqtt_safe_publish(mqtt_client, topic, message, qos=1 if trace is not None else 0)
     if res is not None:
         logger.debug("Message %d queued for publishing", res.mid)
     # res.wait_for_publish()
-
-def write_incident(page, fh, format="json"):
-    """ Write contents of a page to file """
+    if trace is not None:
+        latency_tracer.published(trace, res)
+
+    if incident_tracker is not None and page.parsed:
+        publish_incident_state(page, mqtt_client, capcodes)
+
+def incident_topic(psap, call_id):
+    """ Topic for the retained state of an incident """
+    return "incident/{}/{}".format(psap.lower(), re.sub(r"[/+#\s]", "_", call_id))
+
+def publish_incident_state(page, mqtt_client, capcodes=None):
+    """ Merge the page into its incident and publish the retained state and any delta """
+
+    # Expire by page time so replays of old captures behave like live pages
+    for state in incident_tracker.expire(now=page.timestamp):
+        topic, _ = encode_payload('incident', incident_topic(state['psap'], state['reference']), {})
+        logger.info("Incident %s expired, clearing %s", state['reference'], topic)
+        # An empty retained message removes the retained state
+        mqtt_safe_publish(mqtt_client, topic, b"", qos=1, retain=True)
+
+    state, delta = incident_tracker.update(page, capcodes)
+    if state is None:
+        return
+
+    topic = incident_topic(state['psap'], state['reference'])
+    state_topic, message = encode_payload('incident', topic, state)
+    logger.info("Publishing incident state to MQTT topic %s", state_topic)
+    mqtt_safe_publish(mqtt_client, state_topic, message, qos=1, retain=True)
+
+    if delta is not None:
+        delta_topic, message = encode_payload('incident', topic + "/delta", delta)
+        mqtt_safe_publish(mqtt_client, delta_topic, message, qos=1)
+
+class StageTimer:
+    """ Accumulate wall clock time and call counts for each pipeline stage """
+
+    def __init__(self, observer=None):
+        self.totals = {}
+        self.counts = {}
+        # The async pipeline times its stages on the executor threads
+        self._lock = threading.Lock()
+        # Anything with observe_stage(stage, elapsed), e.g. PagerMetrics
+        self.observer = observer
+
+    def add(self, stage, elapsed):
+        with self._lock:
+            self.totals[stage] = self.totals.get(stage, 0.0) + elapsed
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+        if self.observer is not None:
+            self.observer.observe_stage(stage, elapsed)
+
+    def timed(self, stage, job):
+        """ Run job() and record how long it took """
+        start = time.perf_counter()
+        try:
+            return job()
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def summary(self):
+        """ Return a list of (stage, calls, total seconds, mean microseconds) """
+        rows = []
+        with self._lock:
+            totals = list(self.totals.items())
+            counts = dict(self.counts)
+        for stage, total in totals:
+            calls = counts[stage]
+            rows.append((stage, calls, total, (total / calls) * 1e6 if calls else 0.0))
+        return rows
+
+def write_incident(page, fh):
+    """ Write contents of a page to a page writer (output file, SQLite store) """
     logger.info("Writing page to file")
 
     try:
-        fh.write("{},\n".format(page.to_json()))
-    except OSError as err:
+        fh.write_page(page)
+    except (OSError, sqlite3.Error) as err:
         logger.error("Failed to write to file: %s", err)
         return False
     
@@ -102,11 +253,33 @@ def init_args():
     )
 
     argparser.add_argument('-d', '--debug', action='store_true', help="Enable Debug Output")
+    argparser.add_argument('--log-queue', action='store_true',
+                           help='Write log records from a background thread so logging never blocks ingest')
     argparser.add_argument('-o', '--output', help='Output file')
-    argparser.add_argument('-f', '--format', help='Output format (json, csv)')
+    argparser.add_argument('-f', '--format', help='Output format (ndjson, csv, json)')
+    argparser.add_argument('--sqlite', metavar='DB', help='Save pages to a SQLite database')
+    argparser.add_argument('--archive', metavar='FILE', help='Append raw input lines to an indexed archive file')
     argparser.add_argument('-m', '--mqtt', help='MQTT host')
     argparser.add_argument('-p', '--port', help='MQTT Port')
     argparser.add_argument('-t', '--topic', help='MQTT subscribe topic')
+    argparser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port')
+    argparser.add_argument('--trace-latency', metavar='FILE', nargs='?', const='',
+                           help='Trace per-page latency up to the broker ack, writing spans to FILE if given')
+    argparser.add_argument('--replay', metavar='FILE', help='Replay a raw multimon-ng capture instead of reading stdin')
+    argparser.add_argument('--pace', choices=['max', 'realtime'], default='max',
+                           help='Replay pacing: as fast as possible or following the capture timestamps')
+    argparser.add_argument('--speed', type=float, default=1.0,
+                           help='Speed multiplier for realtime replay pacing')
+    argparser.add_argument('--backfill', metavar='FILE', nargs='+',
+                           help='Parse raw captures on all CPU cores and save/publish the pages in timestamp order')
+    argparser.add_argument('--workers', type=int, help='Worker processes for --backfill (default: CPU count)')
+    argparser.add_argument('--offset', type=int, default=0, help='Start replaying at this byte offset')
+    argparser.add_argument('--follow', action='store_true',
+                           help='Keep replaying lines appended to the capture (like tail -F)')
+    argparser.add_argument('--since', help='Replay from this time (YYYY-MM-DD HH:MM:SS or epoch)')
+    argparser.add_argument('--until', help='Replay up to this time (YYYY-MM-DD HH:MM:SS or epoch)')
+    argparser.add_argument('--async', dest='pipeline', action='store_true',
+                           help='Use the asyncio pipeline with separate read, parse and output stages')
     return argparser
 
 def init_settings(cli_args):
@@ -115,10 +288,26 @@ def init_settings(cli_args):
     if cli_args.debug:
         settings.DEBUG = True
 
+    if cli_args.log_queue:
+        settings.LOG_QUEUE = True
+
     if cli_args.output:
-        settings.OUTPUT_FILE_PATH = os.path.expanduser(cli_args.output)
-        settings.OUTPUT_FORMAT = cli_args.format or "json"
-        settings.OUTPUT_FILE = True
+        settings.OUTPUT_FILE = os.path.expanduser(cli_args.output)
+        settings.OUTPUT_FORMAT = cli_args.format or settings.OUTPUT_FORMAT
+
+    if cli_args.sqlite:
+        settings.SQLITE_DB = os.path.expanduser(cli_args.sqlite)
+
+    if cli_args.metrics_port:
+        settings.METRICS_PORT = cli_args.metrics_port
+
+    if cli_args.trace_latency is not None:
+        settings.LATENCY_TRACING = True
+        if cli_args.trace_latency:
+            settings.LATENCY_TRACE_FILE = os.path.expanduser(cli_args.trace_latency)
+
+    if cli_args.archive:
+        settings.RAW_ARCHIVE = os.path.expanduser(cli_args.archive)
 
     if cli_args.mqtt:
         settings.MQTT_HOST = cli_args.mqtt
@@ -147,9 +336,14 @@ def init_logging(settings):
 
     logging.basicConfig(filename=logfile, format=logformat, datefmt='%Y-%m-%d %H:%M:%S', level=loglevel)
 
+    if settings.LOG_RATE_LIMIT > 0:
+        # Noisy channels can fail to parse on every line
+        rate_limit = RateLimitFilter(burst=settings.LOG_RATE_LIMIT, interval=settings.LOG_RATE_INTERVAL)
+        for name in ('PageParser', 'page_grammar'):
+            logging.getLogger(name).addFilter(rate_limit)
+
 def init_outfile(outfile_path):
     """ Initialize output file """
-    # TODO: add some way to rotate or split files
     
     if outfile_path is None:
         return None
@@ -157,15 +351,71 @@ def init_outfile(outfile_path):
     outfile = os.path.expanduser(outfile_path)
 
     try:
-        fh = open(outfile, 'a')
-    except OSError as err:
+        fh = OutputWriter(
+            outfile,
+            format=settings.OUTPUT_FORMAT,
+            rotate_bytes=settings.OUTPUT_ROTATE_BYTES,
+            rotate_seconds=settings.OUTPUT_ROTATE_SECONDS,
+            compress=settings.OUTPUT_COMPRESS,
+            flush_every=settings.OUTPUT_FLUSH_EVERY,
+            flush_ms=settings.OUTPUT_FLUSH_MS,
+            fsync=settings.OUTPUT_FSYNC,
+            index=settings.OUTPUT_INDEX,
+            index_block_bytes=settings.ARCHIVE_INDEX_BLOCK_BYTES,
+            index_block_seconds=settings.ARCHIVE_INDEX_BLOCK_SECONDS
+        )
+    except (OSError, ValueError) as err:
         logger.error("Failed to open output file %s", err)
         return None
+
+    atexit.register(fh.close)
     
     logger.info("Saving page data to %s", outfile)
     return fh
 
 
+def init_sqlite(db_path):
+    """ Open the SQLite page store """
+
+    path = os.path.expanduser(db_path)
+
+    try:
+        store = SQLiteStore(
+            path,
+            batch_size=settings.SQLITE_BATCH_SIZE,
+            batch_ms=settings.SQLITE_BATCH_MS
+        )
+    except sqlite3.Error as err:
+        logger.error("Failed to open SQLite store %s: %s", path, err)
+        return None
+
+    atexit.register(store.close)
+
+    logger.info("Saving page data to SQLite store %s", path)
+    return store
+
+
+def init_archive(archive_path):
+    """ Open the raw capture archive """
+
+    path = os.path.expanduser(archive_path)
+
+    try:
+        archive = RawArchive(
+            path,
+            block_bytes=settings.ARCHIVE_INDEX_BLOCK_BYTES,
+            block_seconds=settings.ARCHIVE_INDEX_BLOCK_SECONDS
+        )
+    except OSError as err:
+        logger.error("Failed to open raw archive %s: %s", path, err)
+        return None
+
+    atexit.register(archive.close)
+
+    logger.info("Archiving raw input to %s", path)
+    return archive
+
+
 def init_mqtt(mqtt_host, mqtt_port, mqtt_user=None, mqtt_pass=None, mqtt_certfile=None, mqtt_keyfile=None, mqtt_cacerts=None):
     """ 
     Connect to the mqtt broker and return a client object
@@ -175,6 +425,8 @@ def init_mqtt(mqtt_host, mqtt_port, mqtt_user=None, mqtt_pass=None, mqtt_certfil
     def mqtt_on_connect(client, userdata, flags, rc):
         if rc == 0:
             logger.info("Connected to MQTT broker")
+            if mqtt_outbox is not None:
+                mqtt_outbox.on_connect()
         else:
             logger.error("Failed to connect to MQTT broker: return code %d", rc)
 
@@ -209,7 +461,7 @@ def init_mqtt(mqtt_host, mqtt_port, mqtt_user=None, mqtt_pass=None, mqtt_certfil
     client.on_disconnect=mqtt_on_disconnect
     client.on_publish=mqtt_on_publish
     
-    logger.info("Connecting to MQTT broker at {}:{}...".format(broker, port))
+    logger.info("Connecting to MQTT broker at %s:%s...", broker, port)
     try:
         client.connect(broker, port)
     except OSError as err:
@@ -220,7 +472,445 @@ def init_mqtt(mqtt_host, mqtt_port, mqtt_user=None, mqtt_pass=None, mqtt_certfil
         return None
     return client
 
+def shutdown_mqtt(mclient):
+    """ Stop the network loop and disconnect from the broker """
+    if page_dedup is not None:
+        # Publish pages still waiting for duplicates
+        page_dedup.close()
+
+    if mqtt_outbox is not None:
+        mqtt_outbox.close()
+
+    if latency_tracer is not None:
+        # Before stopping the network loop so the last acks can come in
+        latency_tracer.close()
+        log_latency_summary()
+
+    if mclient is None:
+        return
+
+    try:
+        mclient.loop_stop()
+    except Exception:
+        pass
+    mclient.disconnect(reasoncode=0)
+
+def route_page(page, mclient, writers):
+    """
+    Decide where a page returned by the parser should go.
+
+    Returns (publish, write): publish is None or a callable taking the MQTT
+    client, write is True if the page should be saved by the page writers.
+    Free text pages are routed on their classification alone, so their
+    fields are never parsed.
+    """
+
+    if page.kind == PageKind.INCIDENT and page.parsed:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Parsed %s page to %s: %s; %s; %s",
+                        page.psap,
+                        page.capcode,
+                        page.get_calltype(),
+                        page.channel,
+                        page.address_raw
+                    )
+        publish = partial(publish_incident, page) if mclient is not None else None
+        return publish, bool(writers)
+    elif page.kind == PageKind.KEEPALIVE:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Parsed %s page to %s: %s",
+                        page.psap,
+                        page.capcode,
+                        page.get_calltype()
+                    )
+        publish = None
+        if mclient is not None:
+            if getattr(settings, 'MQTT_PUBLISH_KEEPALIVES', True):
+                publish = partial(publish_incident, page)
+
+        write = bool(writers) and getattr(settings, 'OUTPUT_FILE_KEEPALIVES', False)
+        return publish, write
+    elif page.psap == PagePSAP.NORCOM:
+        # Couldn't parse as an incident page, but we'll 
+        # see if the page text is worth grabbing
+
+        if not mclient:
+            return None, False
+
+        # Make sure it's not a SNO011 page sent to NORCOM capcodes (mutual-aid)
+        if page.alpha.startswith('>>'):
+            return None, False
+
+        page_text = page.alpha.replace("<EOT>","").replace("<NUL>","")
+
+        if len(page_text) < 1:
+            return None, False
+
+        if not " " in page_text:
+            return None, False
+
+        logger.info("Raw Alpha: %s", page.alpha)
+            
+        page_data = {
+            'timestamp': page.timestamp,
+            'text': page_text,
+            'psap': str(page.psap),
+            'capcode': page.capcode,
+        }
+
+        return partial(publish_page, page_data), False
+
+    return None, False
+
+def parse_line(parser, line, timer):
+    """
+    Parse one input line, timing it and counting the result. Returns
+    (page, trace); trace is None unless latency tracing is on.
+    """
+    if pager_metrics is not None:
+        pager_metrics.lines.inc()
+
+    start = time.perf_counter()
+    page = parser.parse(line)
+    end = time.perf_counter()
+    timer.add('parse', end - start)
+
+    if page is None:
+        return None, None
+
+    if pager_metrics is not None:
+        pager_metrics.page(page)
+
+    trace = None
+    if latency_tracer is not None:
+        trace = latency_tracer.begin(page, start, end)
+    return page, trace
+
+def dedup_publish(page, publish):
+    """
+    Pass a page's publish callable through the dedup cache. Returns the
+    callable if it should run now, or None if the cache is holding it or
+    the page is a duplicate.
+    """
+    if page_dedup is None or publish is None or page.kind == PageKind.KEEPALIVE:
+        return publish
+    if page_dedup.offer(page.alpha, page.capcode, publish):
+        return partial(publish, capcodes=[page.capcode])
+    return None
+
+def dedup_emit(mclient, publish, capcodes):
+    """ Publish a page released by the dedup cache """
+    publish(mclient, capcodes=capcodes)
+
+def trace_publish(publish, trace):
+    """ Bind a page's latency trace to its publish callable """
+    if publish is None or trace is None:
+        return publish
+    return partial(publish, trace=trace)
+
+def handle_page(page, mclient, writers, timer, trace=None):
+    """ Publish and/or save a page returned by the parser """
+
+    publish, write = route_page(page, mclient, writers)
+    publish = dedup_publish(page, trace_publish(publish, trace))
+
+    if publish is not None:
+        start = time.perf_counter()
+        publish(mclient)
+        timer.add('publish', time.perf_counter() - start)
+
+    if write:
+        for name, writer in writers.items():
+            start = time.perf_counter()
+            write_incident(page, writer)
+            timer.add(name, time.perf_counter() - start)
+
+def init_watchdog(mclient):
+    """ Create the keepalive watchdog, publishing its health to MQTT if enabled """
+
+    on_health = None
+    if mclient is not None and settings.KEEPALIVE_HEALTH_TOPIC:
+        def on_health(health):
+            topic, message = encode_payload('keepalive', settings.KEEPALIVE_HEALTH_TOPIC, health)
+            logger.info("Publishing keepalive health (%s) to MQTT topic %s", health['state'], topic)
+            mqtt_safe_publish(mclient, topic, message, qos=1, retain=True)
+
+    watchdog = KeepaliveWatchdog(
+        interval=settings.KEEPALIVE_INTERVAL,
+        missed=settings.KEEPALIVE_MISSED,
+        on_health=on_health
+    )
+    watchdog.publish()
+    return watchdog
+
+def archive_line(archive, line):
+    """ Append a raw input line to the archive """
+    try:
+        archive.append(line)
+    except OSError as err:
+        logger.error("Failed to write to raw archive: %s", err)
+
+def run_pipeline(parser, mclient, writers, watchdog, archive=None):
+    """ Run the asyncio ingest pipeline on stdin, returns the AsyncPipeline """
+
+    def handle_line(line):
+        line = line.strip()
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received %s", " ".join(line.split()[:5]))
+
+        page, trace = parse_line(parser, line, timer)
+
+        if page is None:
+            return None
+
+        if page.kind == PageKind.KEEPALIVE:
+            watchdog.received()
+
+        publish, write = route_page(page, mclient, writers)
+        publish = dedup_publish(page, trace_publish(publish, trace))
+
+        jobs = {}
+        if publish is not None:
+            jobs['publish'] = partial(timer.timed, 'publish', partial(publish, mclient))
+        if write:
+            for name, writer in writers.items():
+                jobs[name] = partial(timer.timed, name, partial(write_incident, page, writer))
+        if jobs:
+            # The stages read the page on their own threads; parse it here
+            # so they don't all run the lazy parse (and the cache) at once
+            page.ensure_parsed()
+        return jobs
+
+    timer = StageTimer(pager_metrics)
+
+    stages = []
+    if mclient is not None:
+        stages.append('publish')
+    stages.extend(writers)
+
+    pipeline = AsyncPipeline(
+        handle_line,
+        stages,
+        queue_size=settings.PIPELINE_QUEUE_SIZE,
+        stats_interval=settings.PIPELINE_STATS_INTERVAL,
+        on_tick=watchdog.check,
+        # Archived as read, so lines dropped at a full queue are kept too
+        on_read=partial(archive_line, archive) if archive is not None else None,
+    )
+
+    if pager_metrics is not None:
+        def collect_queue_depths():
+            for queue, depth in pipeline.queue_depths().items():
+                pager_metrics.queue_depth.set(depth, queue)
+        pager_metrics.on_collect(collect_queue_depths)
+
+    logger.info("Starting async pipeline (stages: %s)", ", ".join(["parse"] + stages))
+    pipeline.run(sys.stdin)
+    return pipeline
+
+REPLAY_TIMESTAMP_RE = re.compile(r"([0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}):")
+
+def replay_lines(path, since=None, until=None, offset=0, follow=False):
+    """
+    Yield (offset, line) from a capture, seeking with its time index if a
+    window is given, otherwise streaming from offset (and following the
+    file if asked).
+    """
+    if since is None and until is None:
+        with CaptureReader(path, offset=offset, follow=follow) as reader:
+            yield from reader.lines()
+        return
+
+    yield from IndexedArchive(path).lines(since=since, until=until)
+
+def replay(path, parser, mclient, writers, pace="max", speed=1.0, since=None, until=None, offset=0, follow=False):
+    """
+    Stream a raw multimon-ng capture through the parser and output paths.
+
+    With pace="realtime" lines are delayed to follow the gaps between the
+    capture timestamps (divided by speed); with pace="max" they are pushed
+    through as fast as possible. since/until (epoch seconds) limit the
+    replay to a time window, using the capture's index to skip ahead.
+    Otherwise the replay starts at byte offset and, with follow, keeps
+    tailing the capture until interrupted. A throughput summary and the
+    offset to resume from are printed at the end.
+    """
+
+    timer = StageTimer(pager_metrics)
+    counts = {'lines': 0, 'pages': 0, 'parsed': 0, 'keepalive': 0, 'skipped': 0, 'unparsed': 0}
+
+    first_ts = None
+    replay_start = time.monotonic()
+
+    logger.info("Replaying %s (pace: %s)", path, pace)
+
+    resume_offset = offset
+    start = time.perf_counter()
+    try:
+        for line_offset, line in replay_lines(os.path.expanduser(path), since, until, offset, follow):
+            timer.add('read', time.perf_counter() - start)
+            counts['lines'] += 1
+            resume_offset = line_offset + len(line)
+            line = line.decode('utf-8', errors='replace')
+
+            if pace == "realtime":
+                ts_match = REPLAY_TIMESTAMP_RE.match(line)
+                if ts_match is not None:
+                    ts = parse_timestamp(ts_match.group(1))
+                    if first_ts is None:
+                        first_ts = ts
+                    delay = replay_start + (ts - first_ts) / speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+            page, _ = parse_line(parser, line.strip(), timer)
+
+            if page is not None:
+                counts['pages'] += 1
+                if page.parsed:
+                    counts['parsed'] += 1
+                elif page.keepalive:
+                    counts['keepalive'] += 1
+                elif page.skipped:
+                    counts['skipped'] += 1
+                else:
+                    counts['unparsed'] += 1
+
+                handle_page(page, mclient, writers, timer)
+
+            start = time.perf_counter()
+    except KeyboardInterrupt:
+        print("")
+
+    for writer in writers.values():
+        writer.flush()
+
+    elapsed = time.monotonic() - replay_start
+    print_replay_summary(counts, timer, elapsed, parser.cache)
+    print("  resume offset: {}".format(resume_offset))
+    return counts
+
+def backfill(paths, mclient, writers, workers=None, since=None, until=None):
+    """
+    Parse raw captures on a process pool and send the pages through the
+    output paths in timestamp order. Prints throughput and per-worker stats.
+    """
+
+    timer = StageTimer(pager_metrics)
+    job = Backfill(
+        paths,
+        workers=workers,
+        chunk_bytes=settings.BACKFILL_CHUNK_BYTES,
+        cache_size=settings.PARSE_CACHE_SIZE,
+        since=since,
+        until=until
+    )
+
+    backfill_start = time.monotonic()
+    for page in job.pages():
+        handle_page(page, mclient, writers, timer)
+
+    for writer in writers.values():
+        writer.flush()
+
+    elapsed = time.monotonic() - backfill_start
+    print_replay_summary(job.counts, timer, elapsed)
+    print_worker_stats(job.worker_stats)
+    return job.counts
+
+def print_worker_stats(worker_stats):
+    """ Print per worker process totals for a backfill run """
+    print("  {:<10} {:>7} {:>10} {:>10} {:>10} {:>12}".format("worker", "chunks", "MB", "lines", "pages", "lines/sec"))
+    for pid, stats in sorted(worker_stats.items()):
+        rate = stats['lines'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        print("  {:<10} {:>7} {:>10.1f} {:>10} {:>10} {:>12.1f}".format(
+            pid, stats['chunks'], stats['bytes'] / 1e6, stats['lines'], stats['pages'], rate))
+
+def print_replay_summary(counts, timer, elapsed, cache=None):
+    """ Print throughput and per-stage timing for a replay run """
+    rate = lambda n: (n / elapsed) if elapsed > 0 else 0.0
+
+    print("Finished in {:.3f}s".format(elapsed))
+    print("  lines: {} ({:.1f}/sec)".format(counts['lines'], rate(counts['lines'])))
+    print("  pages: {} ({:.1f}/sec)".format(counts['pages'], rate(counts['pages'])))
+    print("  parsed: {}  keepalive: {}  skipped: {}  unparsed: {}".format(
+        counts['parsed'], counts['keepalive'], counts['skipped'], counts['unparsed']))
+    if cache is not None:
+        print("  parse cache: {hits} hits, {misses} misses, {size} entries".format(**cache.stats()))
+    print("  {:<10} {:>10} {:>12} {:>12}".format("stage", "calls", "total ms", "mean us"))
+    for stage, calls, total, mean in timer.summary():
+        print("  {:<10} {:>10} {:>12.3f} {:>12.2f}".format(stage, calls, total * 1000, mean))
+
+def init_metrics(mclient):
+    """ Start the metrics HTTP listener and/or MQTT snapshots """
+
+    registry = metrics.PagerMetrics()
+
+    if mqtt_outbox is not None:
+        registry.on_collect(lambda: registry.queue_depth.set(mqtt_outbox.backlog(), 'outbox'))
+
+    if settings.METRICS_PORT:
+        try:
+            metrics.serve(registry, settings.METRICS_HOST, settings.METRICS_PORT)
+        except OSError as err:
+            logger.error("Failed to start metrics listener on %s:%s: %s",
+                         settings.METRICS_HOST, settings.METRICS_PORT, err)
+            return None
+        logger.info("Serving metrics on http://%s:%d/metrics", settings.METRICS_HOST, settings.METRICS_PORT)
+
+    if settings.METRICS_MQTT_TOPIC and mclient is not None:
+        def publish_snapshot():
+            # Straight to the client: an old snapshot isn't worth replaying from the outbox
+            try:
+                mclient.publish(settings.METRICS_MQTT_TOPIC, registry.render(), qos=0, retain=True)
+            except (OSError, ssl.SSLError) as err:
+                logger.error("Failed to publish metrics: %s", err)
+        metrics.run_every(settings.METRICS_MQTT_INTERVAL, publish_snapshot)
+
+    return registry
+
+def init_tracing():
+    """ Set up per-page latency tracing, its metrics and periodic summary """
+
+    try:
+        tracer = LatencyTracer(
+            window=settings.LATENCY_WINDOW,
+            span_file=os.path.expanduser(settings.LATENCY_TRACE_FILE) if settings.LATENCY_TRACE_FILE else None,
+            ack_timeout=settings.LATENCY_ACK_TIMEOUT
+        )
+    except OSError as err:
+        logger.error("Failed to open latency trace file: %s", err)
+        return None
+
+    if pager_metrics is not None:
+        pager_metrics.on_collect(lambda: pager_metrics.latency_percentiles(tracer.percentiles(), QUANTILES))
+
+    if settings.LATENCY_SUMMARY_INTERVAL > 0:
+        metrics.run_every(settings.LATENCY_SUMMARY_INTERVAL, log_latency_summary, name="latency-summary")
+
+    logger.info("Tracing page latency%s",
+                " to {}".format(settings.LATENCY_TRACE_FILE) if settings.LATENCY_TRACE_FILE else "")
+    return tracer
+
+def log_latency_summary():
+    """ Log the latency percentiles per PSAP and call type """
+    counters = latency_tracer.counters
+    logger.info("Page latency (%d acked, %d queued, %d timed out, %d failed):",
+                counters['acked'], counters['queued'], counters['timeout'], counters['error'])
+    for line in latency_tracer.summary():
+        logger.info(line)
+
 def main():
+    global mqtt_outbox
+    global page_dedup
+    global incident_tracker
+    global pager_metrics
+    global latency_tracer
+
+    # Printed here rather than on import, so backfill workers don't repeat it
+    print(settings)
+
     argparser = init_args()
     args = argparser.parse_args()
     init_settings(args)
@@ -233,14 +923,41 @@ def main():
 
     logger.info("Initialized logging")
 
-    outfile = None
+    # Page writers by name; the name is used for timing and pipeline stages
+    writers = {}
     if settings.OUTPUT_FILE:
         outfile = init_outfile(settings.OUTPUT_FILE)
         if outfile is None:
             sys.exit(1)
+        writers['write'] = outfile
+
+    if settings.SQLITE_DB:
+        store = init_sqlite(settings.SQLITE_DB)
+        if store is None:
+            sys.exit(1)
+        writers['sqlite'] = store
 
     mclient = None
     if settings.MQTT_ENABLE:
+        try:
+            for family in ('incident', 'keepalive', 'text'):
+                payload_codec.get_codec(payload_format(family))
+        except ValueError as err:
+            logger.error("Invalid MQTT payload format: %s", err)
+            sys.exit(1)
+
+        if settings.MQTT_OUTBOX:
+            try:
+                mqtt_outbox = Outbox(
+                    settings.MQTT_OUTBOX,
+                    max_bytes=settings.MQTT_OUTBOX_MAX_BYTES,
+                    drain_rate=settings.MQTT_OUTBOX_DRAIN_RATE,
+                    fsync=settings.MQTT_OUTBOX_FSYNC
+                )
+            except OSError as err:
+                logger.error("Failed to open MQTT outbox: %s", err)
+                sys.exit(1)
+
         logger.info("Setting up MQTT client...")
         try:
             mclient = init_mqtt(
@@ -308,119 +1025,145 @@ def main():
             logger.error("Failed to initialize MQTT client, exiting.")
             sys.exit(1)
 
-    parser = PageParser()
+        if mqtt_outbox is not None:
+            mqtt_outbox.start(mclient)
 
-    ka_last_received = time.time()
-    ka_last_missed = 0
-    
-    while True:
-        try:
-            for line in sys.stdin:
-                line = line.strip()
+        if settings.INCIDENT_TRACKING:
+            incident_tracker = IncidentTracker(
+                ttl=settings.INCIDENT_TTL,
+                path=settings.INCIDENT_STATE_FILE,
+                save_interval=settings.INCIDENT_STATE_SAVE_SECONDS
+            )
+            atexit.register(incident_tracker.close)
+
+        # Hold and TTL are wall clock times, which mean nothing for replayed
+        # pages: an unpaced replay would merge pages hours apart
+        if settings.MQTT_DEDUP_TTL > 0 and (args.replay or args.backfill):
+            logger.info("Not deduplicating replayed pages")
+        elif settings.MQTT_DEDUP_TTL > 0:
+            page_dedup = DedupCache(
+                partial(dedup_emit, mclient),
+                ttl=settings.MQTT_DEDUP_TTL,
+                hold=settings.MQTT_DEDUP_HOLD_MS / 1000.0,
+                max_entries=settings.MQTT_DEDUP_MAX_ENTRIES
+            )
 
-                logger.debug("Received %s", " ".join(line.split()[:5]))
+    if settings.METRICS_PORT or settings.METRICS_MQTT_TOPIC:
+        pager_metrics = init_metrics(mclient)
+        if pager_metrics is None:
+            shutdown_mqtt(mclient)
+            sys.exit(1)
 
-                page = parser.parse(line)
+    parser = PageParser(cache_size=settings.PARSE_CACHE_SIZE)
 
-                if page is None:
-                    continue
+    if args.replay or args.backfill:
+        try:
+            since = parse_time_arg(args.since)
+            until = parse_time_arg(args.until)
+        except ValueError as err:
+            logger.error("Invalid replay time window: %s", err)
+            shutdown_mqtt(mclient)
+            sys.exit(1)
 
-                if page.parsed:
-                    logger.info("Parsed %s page to %s: %s; %s; %s",
-                                page.psap,
-                                page.capcode,
-                                page.get_calltype(),
-                                page.channel,
-                                page.address_raw
-                            )
-                    # print(page.to_json())
-                    if mclient is not None:
-                        publish_incident(page, mclient)
-                    if outfile is not None:
-                        write_incident(page, outfile)
-                elif page.keepalive:
-                    ka_last_received = page.timestamp
-                    logger.info("Parsed %s page to %s: %s",
-                                page.psap,
-                                page.capcode,
-                                page.get_calltype()
-                            )
-                    if mclient is not None:
-                        if getattr(settings, 'MQTT_PUBLISH_KEEPALIVES', True):
-                            publish_incident(page, mclient)
-
-                    if outfile is not None:
-                        if getattr(settings, 'OUTPUT_FILE_KEEPALIVES', False):
-                            write_incident(page, outfile)
-                elif page.psap == PagePSAP.NORCOM:
-                    # Couldn't parse as an incident page, but we'll 
-                    # see if the page text is worth grabbing
-
-                    if not mclient:
-                        page = None
-                        continue
-
-                    # Make sure it's not a SNO011 page sent to NORCOM capcodes (mutual-aid)
-                    if page.alpha.startswith('>>'):
-                        page = None
-                        continue
-
-                    page_text = page.alpha.replace("<EOT>","").replace("<NUL>","")
-
-                    if len(page_text) < 1:
-                        page = None
-                        continue
-
-                    if not " " in page_text:
-                        page = None
-                        continue
-
-
-                    logger.info("Raw Alpha: %s", page.alpha)
-                        
-                    page_data = {
-                        'timestamp': page.timestamp,
-                        'text': page_text,
-                        'psap': str(page.psap),
-                        'capcode': page.capcode,
-                    }
-
-                    publish_page(page_data, mclient)
+        if args.follow and (since is not None or until is not None):
+            logger.error("--follow can't be combined with --since/--until")
+            shutdown_mqtt(mclient)
+            sys.exit(1)
 
-                else:
-                    page = None
+        try:
+            if args.backfill:
+                backfill(args.backfill, mclient, writers, workers=args.workers, since=since, until=until)
+            else:
+                replay(args.replay, parser, mclient, writers, pace=args.pace, speed=args.speed,
+                       since=since, until=until, offset=args.offset, follow=args.follow)
+        except (OSError, ValueError) as err:
+            logger.error("Failed to replay %s: %s", args.backfill or args.replay, err)
+            shutdown_mqtt(mclient)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            print("")
+        shutdown_mqtt(mclient)
+        sys.exit(0)
+
+    # Live input only: a replay or backfill has no receiver to fall behind
+    if settings.LOG_QUEUE:
+        start_queued_logging(queue_size=settings.LOG_QUEUE_SIZE)
+        logger.info("Writing log records from a background thread")
+
+    # Only live input is traced; replayed timestamps are from the past
+    if settings.LATENCY_TRACING and mclient is not None:
+        latency_tracer = init_tracing()
+        if latency_tracer is None:
+            shutdown_mqtt(mclient)
+            sys.exit(1)
 
-            #check if we've missed a keepalive
-            ka_check = time.time()
-            ka_max = getattr(settings, 'KEEPALIVE_MISSED', 3) * 1
-            ka_interval = getattr(settings, 'KEEPALIVE_INTERVAL', 3) * 1
-            ka_delta = round(ka_check - ka_last_missed) if (ka_last_missed > 0) else round(ka_check - ka_last_received)
-
-            if (ka_delta > ka_interval):
-                logger.info("No keepalive received for %d seconds", ka_interval)
-                ka_last_missed = ka_check
-
-                if ka_max > 0:
-                    if round(ka_check - ka_last_received) >= (ka_interval * ka_max):
-                        logger.error("Too many missed keepalives, I'm giving up.")
-                        if mclient is not None:
-                            try:
-                                mclient.loop_stop()
-                            except Exception:
-                                pass
-                            mclient.disconnect(reasoncode=0)
-                        sys.exit(1)
-
-                # break
+    archive = None
+    if settings.RAW_ARCHIVE:
+        archive = init_archive(settings.RAW_ARCHIVE)
+        if archive is None:
+            shutdown_mqtt(mclient)
+            sys.exit(1)
+
+    watchdog = init_watchdog(mclient)
+
+    if args.pipeline or settings.PIPELINE_ASYNC:
+        try:
+            pipeline = run_pipeline(parser, mclient, writers, watchdog, archive)
         except KeyboardInterrupt:
-            if mclient is not None:
-                try:
-                    mclient.loop_stop()
-                except Exception:
-                    pass
-                mclient.disconnect(reasoncode=0)
             print("")
+            shutdown_mqtt(mclient)
             sys.exit(0)
+        if not pipeline.stopped:
+            # Live input only ends when rtl_fm or multimon-ng died; exit
+            # non-zero so the receiver gets restarted
+            logger.error("End of input")
+        shutdown_mqtt(mclient)
+        sys.exit(1)
+
+    timer = StageTimer(pager_metrics)
 
+    # The keepalive check runs at least this often, even when stdin is silent
+    check_interval = settings.KEEPALIVE_CHECK_SECONDS
+    next_check = time.monotonic() + check_interval
+
+    try:
+        for line in poll_lines(sys.stdin, check_interval):
+            if line is not None:
+                if archive is not None:
+                    archive_line(archive, line)
 
-main()
\ No newline at end of file
+                line = line.strip()
+
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Received %s", " ".join(line.split()[:5]))
+
+                page, trace = parse_line(parser, line, timer)
+
+                if page is not None:
+                    if page.kind == PageKind.KEEPALIVE:
+                        watchdog.received()
+
+                    handle_page(page, mclient, writers, timer, trace)
+
+                if time.monotonic() < next_check:
+                    continue
+
+            #check if we've missed a keepalive
+            next_check = time.monotonic() + check_interval
+            if not watchdog.check():
+                shutdown_mqtt(mclient)
+                sys.exit(1)
+    except KeyboardInterrupt:
+        shutdown_mqtt(mclient)
+        print("")
+        sys.exit(0)
+
+    # Live input only ends when rtl_fm or multimon-ng died; exit non-zero so
+    # the receiver gets restarted
+    logger.error("End of input")
+    shutdown_mqtt(mclient)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
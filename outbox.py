@@ -0,0 +1,379 @@
+"""
+Durable MQTT outbox.
+
+Every message is appended to a segment file on disk before it is handed
+to paho, and is only forgotten once the broker acknowledges it (QoS 1
+PUBACK, reported through on_publish with the message id). Anything still
+unacknowledged after a restart is replayed in order once the client is
+connected, at a limited rate so a long backlog doesn't flood the broker or
+starve new pages.
+
+Only one layer retransmits. Messages paho has taken (it keeps QoS 1
+messages across a reconnect and resends them itself, with the same mid)
+stay in flight here until their PUBACK; the outbox only replays the ones
+paho never had, and everything after a restart. Delivery is at least
+once: a message whose PUBACK was lost to a disconnect or a crash is sent
+again, so subscribers can see the occasional duplicate.
+
+On disk the outbox directory holds:
+
+    <first seq>.seg   append-only records: header, topic, payload
+    acks              append-only list of acknowledged sequence numbers
+
+Startup only reads record headers and seeks over the payloads, so it stays
+fast with a large backlog. Segments whose records are all acknowledged are
+deleted. If the directory grows past max_bytes the oldest segment is
+dropped, and the records in it are counted as lost.
+"""
+import os
+import zlib
+import time
+import struct
+import logging
+import threading
+from collections import OrderedDict
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+# seq, topic length, payload length, qos, retain, crc32(topic + payload)
+RECORD_HEADER = struct.Struct('>QIIBBI')
+ACK_RECORD = struct.Struct('>Q')
+
+SEGMENT_SUFFIX = ".seg"
+
+
+class Outbox:
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, segment_bytes=1024 * 1024,
+                 drain_rate=20.0, max_inflight=20, fsync=False):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.drain_rate = drain_rate
+        self.max_inflight = max_inflight
+        self.fsync = fsync
+
+        self.client = None
+        self.connected = False
+
+        # seq -> (segment first seq, offset) for every unacknowledged record
+        self.pending = OrderedDict()
+        # paho mid -> seq for records published and waiting for PUBACK
+        self.inflight = {}
+        # seqs currently inside client.publish()
+        self._sending = set()
+        # mid -> time for PUBACKs that arrived before publish() returned
+        self._early_acks = {}
+        # segment first seq -> number of unacknowledged records in it
+        self.segments = OrderedDict()
+        self.acked = set()
+
+        self.next_seq = 1
+        self.dropped = 0
+
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+        self._segment_fh = None
+        self._segment_seq = None
+        self._ack_fh = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    # -- startup -----------------------------------------------------------
+
+    def _segment_path(self, first_seq):
+        return os.path.join(self.path, "{:016d}{}".format(first_seq, SEGMENT_SUFFIX))
+
+    def _load(self):
+        ack_path = os.path.join(self.path, "acks")
+        if os.path.exists(ack_path):
+            with open(ack_path, 'rb') as fh:
+                data = fh.read()
+            usable = len(data) - len(data) % ACK_RECORD.size
+            self.acked = {seq for (seq,) in ACK_RECORD.iter_unpack(data[:usable])}
+
+        names = sorted(name for name in os.listdir(self.path) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            first_seq = int(name[:-len(SEGMENT_SUFFIX)])
+            self._scan_segment(first_seq)
+
+        # Only keep acks for records that still exist
+        self.acked = {seq for seq in self.acked if seq >= self._min_seq()}
+        self._rewrite_acks()
+
+        for first_seq, count in list(self.segments.items()):
+            if count == 0:
+                self._remove_segment(first_seq)
+
+        if self.pending:
+            logger.info("Outbox has %d unacknowledged messages to replay", len(self.pending))
+
+    def _scan_segment(self, first_seq):
+        path = self._segment_path(first_seq)
+        count = 0
+        offset = 0
+        size = os.path.getsize(path)
+        with open(path, 'rb') as fh:
+            while offset + RECORD_HEADER.size <= size:
+                header = fh.read(RECORD_HEADER.size)
+                seq, topic_len, payload_len, _, _, _ = RECORD_HEADER.unpack(header)
+                end = offset + RECORD_HEADER.size + topic_len + payload_len
+                if end > size:
+                    break
+                if seq not in self.acked:
+                    self.pending[seq] = (first_seq, offset)
+                    count += 1
+                self.next_seq = max(self.next_seq, seq + 1)
+                fh.seek(end)
+                offset = end
+
+        if offset < size:
+            # Torn write from a crash, drop the partial record
+            logger.warning("Outbox: truncating partial record in %s", path)
+            with open(path, 'r+b') as fh:
+                fh.truncate(offset)
+
+        self.segments[first_seq] = count
+
+    def _min_seq(self):
+        return next(iter(self.segments), self.next_seq)
+
+    def _rewrite_acks(self):
+        ack_path = os.path.join(self.path, "acks")
+        if self._ack_fh is not None:
+            self._ack_fh.close()
+        tmp_path = ack_path + ".tmp"
+        with open(tmp_path, 'wb') as fh:
+            fh.write(b"".join(ACK_RECORD.pack(seq) for seq in sorted(self.acked)))
+        os.replace(tmp_path, ack_path)
+        self._ack_fh = open(ack_path, 'ab')
+
+    # -- writing -----------------------------------------------------------
+
+    def _disk_usage(self):
+        total = 0
+        for first_seq in self.segments:
+            try:
+                total += os.path.getsize(self._segment_path(first_seq))
+            except OSError:
+                pass
+        return total
+
+    def _open_segment(self):
+        if self._segment_fh is not None:
+            self._segment_fh.close()
+        self._segment_seq = self.next_seq
+        self._segment_fh = open(self._segment_path(self._segment_seq), 'ab')
+        self.segments[self._segment_seq] = 0
+
+        while len(self.segments) > 1 and self._disk_usage() > self.max_bytes:
+            oldest = next(iter(self.segments))
+            lost = self.segments[oldest]
+            self.dropped += lost
+            logger.error("Outbox over %d bytes, dropping %d unsent messages", self.max_bytes, lost)
+            self._remove_segment(oldest)
+
+    def _remove_segment(self, first_seq):
+        for seq in [seq for seq, (segment, _) in self.pending.items() if segment == first_seq]:
+            del self.pending[seq]
+        self.segments.pop(first_seq, None)
+        if first_seq == self._segment_seq:
+            self._segment_fh.close()
+            self._segment_fh = None
+            self._segment_seq = None
+        try:
+            os.remove(self._segment_path(first_seq))
+        except OSError as err:
+            logger.warning("Outbox: failed to remove segment: %s", err)
+
+    def _append(self, topic, payload, qos, retain):
+        if self._segment_fh is None or self._segment_fh.tell() >= self.segment_bytes:
+            self._open_segment()
+
+        seq = self.next_seq
+        self.next_seq += 1
+
+        topic_bytes = topic.encode('utf-8')
+        offset = self._segment_fh.tell()
+        crc = zlib.crc32(payload, zlib.crc32(topic_bytes))
+        self._segment_fh.write(RECORD_HEADER.pack(seq, len(topic_bytes), len(payload), qos, int(retain), crc))
+        self._segment_fh.write(topic_bytes)
+        self._segment_fh.write(payload)
+        self._segment_fh.flush()
+        if self.fsync:
+            os.fsync(self._segment_fh.fileno())
+
+        self.pending[seq] = (self._segment_seq, offset)
+        self.segments[self._segment_seq] += 1
+        return seq
+
+    def _read(self, seq):
+        first_seq, offset = self.pending[seq]
+        with open(self._segment_path(first_seq), 'rb') as fh:
+            fh.seek(offset)
+            _, topic_len, payload_len, qos, retain, crc = RECORD_HEADER.unpack(fh.read(RECORD_HEADER.size))
+            topic_bytes = fh.read(topic_len)
+            payload = fh.read(payload_len)
+        if zlib.crc32(payload, zlib.crc32(topic_bytes)) != crc:
+            return None
+        return topic_bytes.decode('utf-8'), payload, qos, bool(retain)
+
+    # -- publishing --------------------------------------------------------
+    #
+    # paho calls on_publish while holding its own message lock, so
+    # client.publish() must never be called with self._lock held.
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """
+        Persist a message and publish it if the client is connected and
+        nothing older is waiting. Returns the paho MQTTMessageInfo if the
+        message was handed to the client, otherwise None.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        with self._lock:
+            seq = self._append(topic, payload, qos, retain)
+            # Older messages go first; the drain thread will pick this one up
+            if not self.connected or len(self.pending) > len(self.inflight) + len(self._sending) + 1:
+                self._wake.set()
+                return None
+            self._sending.add(seq)
+
+        return self._send(seq, topic, payload, qos, retain)
+
+    def _send(self, seq, topic, payload, qos, retain):
+        info = None
+        try:
+            info = self.client.publish(topic=topic, payload=payload, qos=max(qos, 1), retain=retain)
+        finally:
+            with self._lock:
+                self._sending.discard(seq)
+                # paho keeps the message unless its queue is full, even when
+                # it isn't connected (MQTT_ERR_NO_CONN), and sends it itself
+                if info is not None and info.rc != mqtt.MQTT_ERR_QUEUE_SIZE:
+                    self.inflight[info.mid] = seq
+                    acked = self._early_acks.pop(info.mid, None) is not None
+                    # Forget PUBACKs for mids that aren't ours (QoS 0 publishes
+                    # made without the outbox)
+                    expired = time.monotonic() - 5
+                    for mid in [mid for mid, seen in self._early_acks.items() if seen < expired]:
+                        del self._early_acks[mid]
+                    if acked:
+                        self.ack(info.mid)
+
+        if info.rc != 0:
+            self._wake.set()
+            return None
+        return info
+
+    def ack(self, mid):
+        """ on_publish callback: the broker has the message with this mid """
+        with self._lock:
+            seq = self.inflight.pop(mid, None)
+            if seq is None:
+                # PUBACK can arrive before publish() has returned the mid to us
+                self._early_acks[mid] = time.monotonic()
+                return
+            self._remove(seq)
+
+    def _remove(self, seq):
+        location = self.pending.pop(seq, None)
+        if location is None:
+            return
+
+        self._ack_fh.write(ACK_RECORD.pack(seq))
+        self._ack_fh.flush()
+        self.acked.add(seq)
+
+        first_seq = location[0]
+        self.segments[first_seq] -= 1
+        if self.segments[first_seq] == 0 and first_seq != self._segment_seq:
+            self._remove_segment(first_seq)
+            self.acked = {seq for seq in self.acked if seq >= self._min_seq()}
+            self._rewrite_acks()
+
+    def on_connect(self):
+        with self._lock:
+            self.connected = True
+        self._wake.set()
+
+    def on_disconnect(self):
+        with self._lock:
+            self.connected = False
+            # Anything in flight is resent by paho after reconnecting; its
+            # PUBACK comes back with the same mid
+
+    # -- draining ----------------------------------------------------------
+
+    def start(self, client):
+        """ Attach the paho client and start the backlog drain thread """
+        self.client = client
+        self._thread = threading.Thread(target=self._drain, name="outbox", daemon=True)
+        self._thread.start()
+        self._wake.set()
+
+    def _next_unsent(self):
+        if len(self.inflight) >= self.max_inflight:
+            return None
+        busy = set(self.inflight.values())
+        busy.update(self._sending)
+        for seq in self.pending:
+            if seq not in busy:
+                return seq
+        return None
+
+    def _drain(self):
+        interval = 1.0 / self.drain_rate if self.drain_rate > 0 else 0
+        while not self._stopped:
+            self._wake.wait(1.0)
+            self._wake.clear()
+
+            while not self._stopped:
+                with self._lock:
+                    if not self.connected:
+                        break
+                    seq = self._next_unsent()
+                    if seq is None:
+                        break
+                    try:
+                        message = self._read(seq)
+                    except OSError as err:
+                        logger.error("Outbox: failed to read message %d: %s", seq, err)
+                        break
+                    if message is None:
+                        logger.error("Outbox: dropping corrupt message %d", seq)
+                        self._remove(seq)
+                        continue
+                    self._sending.add(seq)
+
+                try:
+                    self._send(seq, *message)
+                except OSError as err:
+                    logger.error("Outbox: failed to publish message %d: %s", seq, err)
+                    break
+
+                if interval:
+                    time.sleep(interval)
+
+    def backlog(self):
+        return len(self.pending)
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        with self._lock:
+            if self._segment_fh is not None:
+                self._segment_fh.close()
+                self._segment_fh = None
+            if self._ack_fh is not None:
+                self._ack_fh.close()
+                self._ack_fh = None
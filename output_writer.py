@@ -0,0 +1,217 @@
+"""
+Buffered, rotating output file for parsed pages.
+
+Pages are written as NDJSON (one object per line), CSV, or the legacy
+"json" format ("{...},\\n"). Writes go to an in-memory buffer that is
+flushed every `flush_every` pages or `flush_ms` milliseconds, whichever
+comes first, with an optional fsync per flush. Batching writes this way
+keeps small random writes off SD cards.
+
+The active file always lives at the configured path. When it grows past
+`rotate_bytes` or is older than `rotate_seconds`, it is renamed to
+<name>-<YYYYmmddTHHMMSS><ext> and compressed with gzip or xz on a
+background thread.
+
+With `index` set, a sparse time index (see archive_index) is kept next to
+NDJSON and json output as <path>.idx and follows the file when it's
+rotated. Compressed segments can't be seeked, so they lose their index.
+"""
+import io
+import os
+import csv
+import gzip
+import lzma
+import time
+import shutil
+import logging
+import threading
+
+from archive_index import IndexBuilder, index_path
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'json', 'csv')
+COMPRESSORS = {
+    'gzip': (gzip.open, '.gz'),
+    'xz': (lzma.open, '.xz'),
+}
+
+CSV_COLUMNS = (
+    'timestamp', 'capcode', 'psap', 'channel', 'units',
+    'location_name', 'address', 'lat', 'long',
+    'call_type', 'call_subtype', 'alarm_level', 'reference', 'cad_notes',
+)
+
+
+def page_csv_row(page):
+    """ Flatten a page into the CSV_COLUMNS layout """
+    geo = page.geo or {}
+    return (
+        page.timestamp, page.capcode, str(page.psap), page.channel, ",".join(page.units),
+        page.address_name, page.address_raw, geo.get('lat'), geo.get('long'),
+        page.call_type, page.call_subtype, page.alarm_level, page.call_id, page.call_notes,
+    )
+
+
+class OutputWriter:
+
+    def __init__(self, path, format="json", rotate_bytes=0, rotate_seconds=0,
+                 compress=None, flush_every=1, flush_ms=0, fsync=False,
+                 index=False, index_block_bytes=64 * 1024, index_block_seconds=300):
+        if format not in FORMATS:
+            raise ValueError("unknown output format {!r}, expected one of {}".format(format, ", ".join(FORMATS)))
+        if compress and compress not in COMPRESSORS:
+            raise ValueError("unknown compression {!r}, expected one of {}".format(compress, ", ".join(COMPRESSORS)))
+        if index and format == 'csv':
+            raise ValueError("the time index is only supported for ndjson and json output")
+
+        self.path = os.path.expanduser(path)
+        self.format = format
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.flush_every = max(flush_every, 1)
+        self.flush_ms = flush_ms
+        self.fsync = fsync
+        self.index = index
+        self.index_block_bytes = index_block_bytes
+        self.index_block_seconds = index_block_seconds
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered_at = None
+        self._fh = None
+        self._opened_at = None
+        self._size = 0
+        self._index = None
+        self._closed = False
+
+        self._open()
+
+        self._flusher = None
+        if self.flush_ms > 0:
+            self._flusher = threading.Thread(target=self._flush_timer, name="output-flush", daemon=True)
+            self._flusher.start()
+
+    def _open(self):
+        self._fh = open(self.path, 'ab')
+        self._size = self._fh.tell()
+        self._opened_at = time.time()
+        if self.index:
+            self._index = IndexBuilder(self.path, block_bytes=self.index_block_bytes,
+                                       block_seconds=self.index_block_seconds)
+            self._index.catch_up(self.path)
+        if self.format == 'csv' and self._size == 0:
+            self._buffer.append(self._csv_line(CSV_COLUMNS))
+
+    def _csv_line(self, row):
+        out = io.StringIO()
+        csv.writer(out).writerow(row)
+        return out.getvalue().encode('utf-8')
+
+    def _encode(self, page):
+        if self.format == 'csv':
+            return self._csv_line(page_csv_row(page))
+        elif self.format == 'json':
+            return page.to_json_bytes() + b",\n"
+        return page.to_json_bytes() + b"\n"
+
+    def write_page(self, page):
+        data = self._encode(page)
+        with self._lock:
+            if self._buffered_at is None:
+                self._buffered_at = time.monotonic()
+            self._buffer.append(data)
+            if len(self._buffer) >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self, rotate=True):
+        if self._buffer:
+            lines = self._buffer
+            data = b"".join(lines)
+            self._buffer = []
+            self._buffered_at = None
+            self._fh.write(data)
+            self._fh.flush()
+            if self.fsync:
+                os.fsync(self._fh.fileno())
+            if self._index is not None:
+                offset = self._size
+                for line in lines:
+                    self._index.observe(offset, line)
+                    offset += len(line)
+            self._size += len(data)
+
+        if rotate and self._should_rotate():
+            self._rotate()
+
+    def _should_rotate(self):
+        if self._size == 0:
+            return False
+        if self.rotate_bytes and self._size >= self.rotate_bytes:
+            return True
+        if self.rotate_seconds and time.time() - self._opened_at >= self.rotate_seconds:
+            return True
+        return False
+
+    def _rotate(self):
+        self._fh.close()
+        base, ext = os.path.splitext(self.path)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(self._opened_at))
+        closed_path = "{}-{}{}".format(base, stamp, ext)
+        suffix = 1
+        while os.path.exists(closed_path) or (self.compress and os.path.exists(closed_path + COMPRESSORS[self.compress][1])):
+            closed_path = "{}-{}.{}{}".format(base, stamp, suffix, ext)
+            suffix += 1
+
+        os.rename(self.path, closed_path)
+        if self._index is not None:
+            self._index.close()
+            os.rename(index_path(self.path), index_path(closed_path))
+        logger.info("Rotated output file to %s", closed_path)
+        self._open()
+
+        if self.compress:
+            threading.Thread(target=self._compress, args=(closed_path,), name="output-compress").start()
+
+    def _compress(self, path):
+        opener, ext = COMPRESSORS[self.compress]
+        try:
+            with open(path, 'rb') as src, opener(path + ext, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(path)
+            if self.index and os.path.exists(index_path(path)):
+                os.remove(index_path(path))
+        except OSError as err:
+            logger.error("Failed to compress %s: %s", path, err)
+
+    def _flush_timer(self):
+        interval = self.flush_ms / 1000.0
+        while not self._closed:
+            time.sleep(interval)
+            with self._lock:
+                if self._closed:
+                    break
+                try:
+                    if self._buffered_at is not None and time.monotonic() - self._buffered_at >= interval:
+                        self._flush()
+                    elif self.rotate_seconds and self._should_rotate():
+                        self._rotate()
+                except OSError as err:
+                    logger.error("Failed to write to file: %s", err)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._flush(rotate=False)
+            finally:
+                self._fh.close()
+                if self._index is not None:
+                    self._index.close()
@@ -0,0 +1,234 @@
+"""
+Declarative grammars for the incident pages of a PSAP.
+
+A grammar lists the fields of a page format:
+
+    DelimitedGrammar   fields split on a delimiter (NORCOM's ;-separated layout)
+    SequenceGrammar    Tokens matched left to right, each one where the
+                       previous one ended (SNO911's >>TYPE<< ADDR / NAME / *UNITS*)
+
+Each delimited field or regex group maps to a Field: the page attribute it
+sets ("geo.lat" sets a key of the geo dict, a tuple of names sets several
+attributes) and an optional normalizer. Normalizers return the cleaned
+value and raise ValueError to reject the page.
+
+When it's defined, a grammar is compiled into a single Python function (see
+`source`) that runs the matches and assignments in order, the same code one
+would write by hand for the format, so no per-field dispatch is left at
+parse time.
+
+The grammar of each PSAP is in psap_grammars.
+"""
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Field:
+    """ Where one delimited field or regex group goes, and how it is cleaned up """
+
+    def __init__(self, name, normalize=None):
+        self.name = name
+        self.normalize = normalize
+
+        if normalize is None and isinstance(name, tuple):
+            raise ValueError("fields {} need a normalizer to split the value".format(name))
+
+    def compile(self, value, names):
+        """ Source line storing `value` (an expression) on page """
+        if self.normalize is strip:
+            value = "{}.strip()".format(value)
+        elif self.normalize is not None:
+            value = "{}({})".format(names.add(self.normalize, 'normalize'), value)
+
+        if isinstance(self.name, tuple):
+            return "({}) = {}".format(", ".join("page." + name for name in self.name), value)
+        if '.' in self.name:
+            (attr, key) = self.name.split('.', 1)
+            return "page.{}[{!r}] = {}".format(attr, key, value)
+        return "page.{} = {}".format(self.name, value)
+
+
+class Token:
+    """
+    A regex matched at the current position of a SequenceGrammar, with a
+    Field per group. An optional token that doesn't match is skipped. The
+    text after the last token can go to its `rest` Field, which is cheaper
+    than a trailing (.*) group.
+    """
+
+    def __init__(self, name, pattern, *fields, optional=False, rest=None):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        if self.pattern.groups != len(fields):
+            raise ValueError("token {}: {} groups but {} fields".format(name, self.pattern.groups, len(fields)))
+        self.fields = fields
+        self.optional = optional
+        self.rest = rest
+
+    def compile_match(self, names):
+        """ Source lines matching the token into `found`; the caller checks for None """
+        return ["found = {}(text, pos)".format(names.add(self.pattern.match, 'match'))]
+
+    def compile_fields(self, names):
+        """ Source lines storing the groups of `found` and moving pos past it """
+        lines = [ field.compile("found.group({})".format(group), names)
+                  for (group, field) in enumerate(self.fields, 1) ]
+        lines.append("pos = found.end()")
+        if self.rest is not None:
+            lines.append(self.rest.compile("text[pos:]", names))
+        return lines
+
+    def compile(self, names):
+        lines = self.compile_match(names)
+        if self.optional:
+            lines.append("if found is not None:")
+        else:
+            lines += ["if found is None:", "    return {!r}".format("couldn't parse " + self.name)]
+            return lines + self.compile_fields(names)
+        return lines + [ "    " + line for line in self.compile_fields(names) ]
+
+
+class OneOf:
+    """ The first of several Tokens that matches """
+
+    def __init__(self, name, *tokens):
+        self.name = name
+        self.tokens = tokens
+
+    def compile(self, names):
+        lines = []
+        indent = ""
+        for token in self.tokens:
+            lines += [ indent + line for line in token.compile_match(names) ]
+            lines.append(indent + "if found is not None:")
+            lines += [ indent + "    " + line for line in token.compile_fields(names) ]
+            lines.append(indent + "else:")
+            indent += "    "
+        lines.append(indent + "return {!r}".format("couldn't parse " + self.name))
+        return lines
+
+
+class _Names(dict):
+    """ Namespace of the objects a compiled grammar calls """
+
+    def add(self, obj, prefix):
+        name = "{}{}".format(prefix, len(self))
+        self[name] = obj
+        return name
+
+
+class Grammar:
+
+    def __init__(self, name):
+        self.name = name
+        self.source = None
+        self._parse = None
+
+    def compile_body(self, names):
+        """ Source lines of the parse function body, returning an error string or None """
+        raise NotImplementedError
+
+    def compile(self):
+        names = _Names()
+        body = self.compile_body(names) + ["return None"]
+        self.source = "def parse(page, text):\n" + "".join("    {}\n".format(line) for line in body)
+        exec(compile(self.source, "<{} grammar>".format(self.name), "exec"), names)
+        self._parse = names['parse']
+
+    def clean(self, alpha):
+        """ The page text without multimon-ng markers (the same string if there are none) """
+        return alpha.replace("<EOT>", "").replace("<NUL>", "")
+
+    def matches(self, text):
+        """ Cheap check that a cleaned text looks like an incident page of this format """
+        raise NotImplementedError
+
+    def parse(self, page):
+        """ Set the page's fields from its text; False (and logged) if it doesn't fit the grammar """
+        try:
+            error = self._parse(page, self.clean(page.alpha))
+        except ValueError as err:
+            error = err
+        if error is not None:
+            logger.warning("PARSE FAILED: %s %s", error, page.alpha)
+            return False
+        return True
+
+
+class DelimitedGrammar(Grammar):
+
+    def __init__(self, name, delimiter, *fields):
+        super().__init__(name)
+        self.delimiter = delimiter
+        self.fields = fields
+        self.compile()
+
+    def compile_body(self, names):
+        values = [ "value{}".format(i) for i in range(len(self.fields)) ]
+        lines = [
+            "values = text.split({!r})".format(self.delimiter),
+            "if len(values) != {}:".format(len(values)),
+            "    return {!r}".format("expected {} fields".format(len(values))),
+            "({},) = values".format(", ".join(values)),
+        ]
+        return lines + [ field.compile(value, names) for (value, field) in zip(values, self.fields) ]
+
+    def matches(self, text):
+        return text.count(self.delimiter) == len(self.fields) - 1
+
+
+class SequenceGrammar(Grammar):
+
+    def __init__(self, name, *tokens):
+        super().__init__(name)
+        self.tokens = tokens
+        self.compile()
+
+    def compile_body(self, names):
+        lines = ["pos = 0"]
+        for token in self.tokens:
+            lines += token.compile(names)
+        return lines
+
+    def clean(self, alpha):
+        # Trailing whitespace isn't part of the last token
+        return alpha.replace("<EOT>", "").replace("<NUL>", "").rstrip()
+
+    def matches(self, text):
+        return self.tokens[0].pattern.match(text) is not None
+
+
+# Normalizers shared by the PSAP grammars
+
+def strip(value):
+    return value.strip()
+
+
+def leading(pattern):
+    """ The part of the value matching `pattern` at its start, or the whole value if it doesn't """
+    match = re.compile(pattern).match
+
+    def normalize(value):
+        found = match(value)
+        return found.group(0) if found is not None else value
+    return normalize
+
+
+def remove_chars(chars):
+    """ Strip the value, then delete every one of `chars` from it """
+    table = str.maketrans('', '', chars)
+
+    def normalize(value):
+        return value.strip().translate(table)
+    return normalize
+
+
+def unit_list(min_length=0):
+    """ Comma separated unit ids, leaving out ones shorter than `min_length` """
+    def normalize(value):
+        units = [ k.strip() for k in value.split(',') ]
+        if min_length:
+            units = [ unit for unit in units if len(unit) >= min_length ]
+        return units
+    return normalize
@@ -1,9 +1,45 @@
+"""
+Legacy page output shape, as written by listen.py.
+
+Pages are parsed by PageParser like everywhere else; from_page() renders a
+parsed page in the shape the old regex page models produced:
+
+    {"page_type": "SNOHOMISH", "pager_address": "1310001", "description": "patient fell",
+     "time": "2024-01-05T12:34:56-08:00", "address": "1234 MAIN ST", "type": "MED",
+     "type2": "Aid Call", "channel": "5", "units": ["E71", "M14"]}
+
+NORCOM pages also have "lat" and "lon".
+
+Like the old models it only returns parsed incident pages and NORCOM
+address changes, and drops short or corrupted transmissions.
+"""
 import re
-import coloredlogs, logging, verboselogs
-from verboselogs import VerboseLogger as getLogger
 import datetime
 
-logger = getLogger(__name__)
+from fastjson import dumps_dict_bytes
+from PageParser import PagePSAP, PageKind
+
+# Control characters multimon-ng prints for corrupted transmissions
+CORRUPTED_RE = re.compile(r"<(?:SOH|DEL|SI|CAN|EM|DC2|DC4|NAK)>")
+
+ADDRESS_CHANGE_RE = re.compile(r"\s*ADDRESS CHANGE:?([^#]*)#")
+
+CHANNEL_NUMBER_RE = re.compile(r"(\d+)$")
+
+# Shorter page texts are noise
+MIN_TEXT_LENGTH = 14
+
+
+def channel_number(channel):
+    """ "FTAC3" / "FIRE TAC 5" -> "3" / "5" """
+    if not channel:
+        return None
+    match = CHANNEL_NUMBER_RE.search(channel)
+    return match.group(1) if match is not None else None
+
+
+def strip_or_none(value):
+    return value.strip() if value else None
 
 
 class Page:
@@ -29,82 +65,92 @@ class Page:
     def __str__(self):
         return repr((self.__dict__))
 
+    def to_json_bytes(self):
+        """ Same output as json.dumps(self.__dict__).encode() """
+        return dumps_dict_bytes(self.__dict__)
+
+    @classmethod
+    def from_page(cls, page):
+        legacy = cls(page.capcode, page.alpha)
+        legacy.time = datetime.datetime.fromtimestamp(page.timestamp).astimezone().isoformat()
+        return legacy
+
 
 class SnohomishPage(Page):
     page_type = 'SNOHOMISH'
-    pattern = "  >>([A-Z0-9\- ]+)<<(.+)"
-    channel_pattern = " * FIRE ?TAC ?(\d\d)(.*)"
-    location_pattern = " *([^\/]*) *\/ +([^\/]*) +\/ +(.*)"
-    location_pattern2 = " *([^\/]*) *\/\/ *(.*)"
-    unit_pattern = "([A-Z0-9]+) +\*([A-Z0-9, ]+)\*(.*)"
-    alarm_pattern = "-? ?Alarm Level: ?(\d+) (.*)"
 
     def __init__(self, address, payload):
         super().__init__(self.page_type, address, payload)
-        m = re.match(self.pattern, payload)
-        self.type = m.group(1)
-        if " - " in self.type:
-            self.type, self.type2 = self.type.split(" - ")
-        self.description = m.group(2)
-        m = re.match(self.channel_pattern, self.description)
-        if m:
-            self.channel = m.group(1)
-            self.description = m.group(2)
-        m = re.match(self.location_pattern, self.description)
-        n = re.match(self.location_pattern2, self.description)
-        if m:
-            self.address = m.group(1)
-            # self.location = m.group(2)
-            self.description = m.group(3)
-        elif n:
-            self.address = n.group(1)
-            # self.location = ""
-            self.description = n.group(2)
-        #filter out alarm levels
-        m = re.match(self.alarm_pattern, self.address)
-        if m:
-            self.address = m.group(2)
-        m = re.match(self.unit_pattern, self.description)
-        if m:
-            # self.station = m.group(1)
-            self.units = [i.strip() for i in m.group(2).strip().split(",")]
-            self.description = m.group(3).strip()
-        self.description = self.description.strip()
+
+    @classmethod
+    def from_page(cls, page):
+        legacy = super().from_page(page)
+        legacy.address = strip_or_none(page.address_raw)
+        legacy.type = page.call_type
+        legacy.type2 = page.call_subtype
+        legacy.channel = channel_number(page.channel)
+        legacy.units = list(page.units)
+        legacy.description = page.call_notes or ""
+        return legacy
 
 
 class NORCOMPage(Page):
     page_type = 'NORCOM'
-    #pattern = "  (.*)#(.*)FTAC(\d)(.*)#LAT:?(\d+) *#LON:?(\d+)(.*)"
-    pattern = "  ([\w -]+); \*(FTAC - \d)?\*;  ([\w\d \/]+)?; ([\d\w, @]+); ([\d\w ,]+); ([\d.]+);(-[\d.]+)"
 
     def __init__(self, address, payload):
         super().__init__(self.page_type, address, payload)
-        m = re.match(self.pattern, payload)
-        self.address = m.group(4).strip()
-        self.type = m.group(1).strip()
-        if " - " in self.type:
-            self.type, self.type2 = self.type.split(" - ")[0:2]
-        self.description = m.group(3)
-        if self.description:
-            self.description = self.description.strip()
-        self.channel = m.group(2)
-        if self.channel and " - " in self.channel:
-            self.channel = self.channel.split(" - ")[1].strip()
-        self.units = [i.strip() for i in m.group(5).strip().split(", ")]
-        self.lat = m.group(6)
-        self.lon = m.group(7)
+
+    @classmethod
+    def from_page(cls, page):
+        legacy = super().from_page(page)
+        legacy.address = page.address_raw
+        legacy.type = page.call_type
+        legacy.type2 = page.call_subtype
+        legacy.channel = channel_number(page.channel)
+        legacy.units = list(page.units)
+        legacy.description = page.address_name or None
+        legacy.lat = strip_or_none(page.geo.get('lat'))
+        legacy.lon = strip_or_none(page.geo.get('long'))
+        return legacy
 
 
 class NORCOMAddressChange(Page):
     page_type = 'NORCOM_ADDRESS_CHANGE'
-    pattern = "  ADDRESS CHANGE:?(.*)#(.*)#(.*)"
 
     def __init__(self, address, payload):
         super().__init__(self.page_type, address, payload)
-        m = re.match(self.pattern, payload)
-        self.address = m.group(1).strip()
+
+    @classmethod
+    def from_page(cls, page, match):
+        legacy = super().from_page(page)
+        legacy.address = match.group(1).strip()
         # lat/long on address changes are blank
-        # self.lat = m.group(2).strip()
-        # self.lon = m.group(3).strip()
-        #
-        self.description = None
+        legacy.description = None
+        return legacy
+
+
+# Legacy model for each PSAP's incident pages
+LEGACY_TYPES = {
+    PagePSAP.SNO911: SnohomishPage,
+    PagePSAP.NORCOM: NORCOMPage,
+}
+
+
+def from_page(page):
+    """ Legacy model for a PageParser page, or None if the old models dropped such pages """
+    text = page.alpha.split("<EOT>", 1)[0] if page.alpha else ""
+    if len(text) < MIN_TEXT_LENGTH or CORRUPTED_RE.search(text) is not None:
+        return None
+
+    if page.kind == PageKind.INCIDENT:
+        cls = LEGACY_TYPES.get(page.psap)
+        if cls is not None and page.parsed:
+            return cls.from_page(page)
+        return None
+
+    if page.kind == PageKind.TEXT and page.psap == PagePSAP.NORCOM:
+        match = ADDRESS_CHANGE_RE.match(text)
+        if match is not None:
+            return NORCOMAddressChange.from_page(page, match)
+
+    return None
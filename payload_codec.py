@@ -0,0 +1,171 @@
+"""
+Payload encodings for MQTT messages.
+
+JSON is the default. CBOR (RFC 8949) and MessagePack are implemented
+here for the subset of types pages produce (dict, list, str, int, float,
+bool, None) so there's no extra dependency. Binary payloads are published
+under a "<format>/v<SCHEMA_VERSION>/" topic prefix so consumers can
+subscribe to the encoding and schema version they understand.
+"""
+import json
+import struct
+
+# Bump when the layout of the published page/text messages changes
+SCHEMA_VERSION = 1
+
+
+def encode_json(data):
+    return json.dumps(data).encode('utf-8')
+
+
+def _cbor_head(out, major, value):
+    if value < 24:
+        out.append((major << 5) | value)
+    elif value < 0x100:
+        out.append((major << 5) | 24)
+        out.append(value)
+    elif value < 0x10000:
+        out.append((major << 5) | 25)
+        out += struct.pack('>H', value)
+    elif value < 0x100000000:
+        out.append((major << 5) | 26)
+        out += struct.pack('>I', value)
+    else:
+        out.append((major << 5) | 27)
+        out += struct.pack('>Q', value)
+
+
+def _cbor_item(out, item):
+    if item is None:
+        out.append(0xf6)
+    elif item is True:
+        out.append(0xf5)
+    elif item is False:
+        out.append(0xf4)
+    elif isinstance(item, str):
+        data = item.encode('utf-8')
+        _cbor_head(out, 3, len(data))
+        out += data
+    elif isinstance(item, int):
+        if item >= 0:
+            _cbor_head(out, 0, item)
+        else:
+            _cbor_head(out, 1, -1 - item)
+    elif isinstance(item, float):
+        out.append(0xfb)
+        out += struct.pack('>d', item)
+    elif isinstance(item, dict):
+        _cbor_head(out, 5, len(item))
+        for key, value in item.items():
+            _cbor_item(out, key)
+            _cbor_item(out, value)
+    elif isinstance(item, (list, tuple)):
+        _cbor_head(out, 4, len(item))
+        for value in item:
+            _cbor_item(out, value)
+    elif isinstance(item, (bytes, bytearray)):
+        _cbor_head(out, 2, len(item))
+        out += item
+    else:
+        raise TypeError("can't encode {} as CBOR".format(type(item).__name__))
+
+
+def encode_cbor(data):
+    out = bytearray()
+    _cbor_item(out, data)
+    return bytes(out)
+
+
+def _msgpack_length(out, length, fix, fix_max, one, two, four):
+    if length <= fix_max and fix is not None:
+        out.append(fix | length)
+    elif length < 0x100 and one is not None:
+        out.append(one)
+        out.append(length)
+    elif length < 0x10000:
+        out.append(two)
+        out += struct.pack('>H', length)
+    else:
+        out.append(four)
+        out += struct.pack('>I', length)
+
+
+def _msgpack_item(out, item):
+    if item is None:
+        out.append(0xc0)
+    elif item is True:
+        out.append(0xc3)
+    elif item is False:
+        out.append(0xc2)
+    elif isinstance(item, str):
+        data = item.encode('utf-8')
+        _msgpack_length(out, len(data), 0xa0, 31, 0xd9, 0xda, 0xdb)
+        out += data
+    elif isinstance(item, int):
+        if 0 <= item < 0x80:
+            out.append(item)
+        elif -32 <= item < 0:
+            out.append(item & 0xff)
+        elif item >= 0:
+            if item < 0x100:
+                out += b'\xcc' + struct.pack('>B', item)
+            elif item < 0x10000:
+                out += b'\xcd' + struct.pack('>H', item)
+            elif item < 0x100000000:
+                out += b'\xce' + struct.pack('>I', item)
+            else:
+                out += b'\xcf' + struct.pack('>Q', item)
+        else:
+            if item >= -0x80:
+                out += b'\xd0' + struct.pack('>b', item)
+            elif item >= -0x8000:
+                out += b'\xd1' + struct.pack('>h', item)
+            elif item >= -0x80000000:
+                out += b'\xd2' + struct.pack('>i', item)
+            else:
+                out += b'\xd3' + struct.pack('>q', item)
+    elif isinstance(item, float):
+        out += b'\xcb' + struct.pack('>d', item)
+    elif isinstance(item, dict):
+        _msgpack_length(out, len(item), 0x80, 15, None, 0xde, 0xdf)
+        for key, value in item.items():
+            _msgpack_item(out, key)
+            _msgpack_item(out, value)
+    elif isinstance(item, (list, tuple)):
+        _msgpack_length(out, len(item), 0x90, 15, None, 0xdc, 0xdd)
+        for value in item:
+            _msgpack_item(out, value)
+    elif isinstance(item, (bytes, bytearray)):
+        _msgpack_length(out, len(item), None, -1, 0xc4, 0xc5, 0xc6)
+        out += item
+    else:
+        raise TypeError("can't encode {} as MessagePack".format(type(item).__name__))
+
+
+def encode_msgpack(data):
+    out = bytearray()
+    _msgpack_item(out, data)
+    return bytes(out)
+
+
+CODECS = {
+    'json': encode_json,
+    'cbor': encode_cbor,
+    'msgpack': encode_msgpack,
+}
+
+
+def get_codec(name):
+    """ Return the encoder for a payload format name """
+    try:
+        return CODECS[name.lower()]
+    except KeyError:
+        raise ValueError("unknown payload format {!r}, expected one of {}".format(
+            name, ", ".join(CODECS)))
+
+
+def codec_topic(topic, name):
+    """ Prefix the topic with the format and schema version for binary formats """
+    if name == 'json':
+        return topic
+    return "{}/v{}/{}".format(name, SCHEMA_VERSION, topic)
@@ -0,0 +1,200 @@
+"""
+asyncio ingest pipeline.
+
+Lines are read from a pipe without blocking, parsed, and handed to one or
+more output stages (MQTT publish, file write) over bounded queues. Output
+jobs run on a dedicated worker thread per stage, so a slow broker or disk
+only backs up its own queue. When a queue is full the item is dropped and
+counted rather than making the stage before it wait, so reading from the
+multimon-ng pipe never stalls on network or file I/O.
+"""
+import sys
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPipeline:
+    """
+    handle_line(line) is called for every line read and returns a dict of
+    stage name -> job, where a job is a zero-argument callable run on that
+    stage's worker thread. on_tick(), if given, is called once a second and
+    may return False to stop the pipeline. on_read(line), if given, is
+    called for every line read, in order and on its own thread, before the
+    line can be dropped at a full queue (e.g. to archive the raw input).
+    """
+
+    def __init__(self, handle_line, stages, queue_size=1000, stats_interval=60, on_tick=None, on_read=None):
+        self.handle_line = handle_line
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.stats_interval = stats_interval
+        self.on_tick = on_tick
+        self.on_read = on_read
+
+        self.counters = {'lines': 0, 'dropped_read': 0}
+        for stage in self.stages:
+            self.counters['jobs_' + stage] = 0
+            self.counters['dropped_' + stage] = 0
+            self.counters['errors_' + stage] = 0
+
+        self.line_queue = None
+        self.stage_queues = {}
+        self.stopped = False
+        self._stopping = None
+        self._read_executor = None
+
+    def run(self, stream=None):
+        """ Run until the input reaches EOF or the pipeline is stopped """
+        return asyncio.run(self._run(stream or sys.stdin))
+
+    def queue_depths(self):
+        depths = {'parse': self.line_queue.qsize() if self.line_queue else 0}
+        for stage, queue in self.stage_queues.items():
+            depths[stage] = queue.qsize()
+        return depths
+
+    def log_stats(self):
+        depths = self.queue_depths()
+        logger.info("Pipeline: %s; queue depth: %s",
+                    ", ".join("{} {}".format(k, v) for k, v in self.counters.items()),
+                    ", ".join("{} {}".format(k, v) for k, v in depths.items()))
+
+    async def _run(self, stream):
+        self.line_queue = asyncio.Queue(self.queue_size)
+        self.stage_queues = {stage: asyncio.Queue(self.queue_size) for stage in self.stages}
+        self._stopping = asyncio.Event()
+
+        executors = {stage: ThreadPoolExecutor(max_workers=1, thread_name_prefix=stage) for stage in self.stages}
+        if self.on_read is not None:
+            # Unbounded, so on_read sees every line even when the queues are full
+            self._read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="on_read")
+        workers = [asyncio.create_task(self._parse_stage())]
+        for stage in self.stages:
+            workers.append(asyncio.create_task(self._output_stage(stage, executors[stage])))
+        timer = asyncio.create_task(self._timer())
+        reader = asyncio.create_task(self._read(stream))
+
+        stopping = asyncio.create_task(self._stopping.wait())
+        await asyncio.wait([reader, stopping], return_when=asyncio.FIRST_COMPLETED)
+
+        if not self._stopping.is_set():
+            # EOF: let the queues drain before shutting down the stages
+            await self.line_queue.join()
+            for queue in self.stage_queues.values():
+                await queue.join()
+
+        tasks = workers + [timer, reader, stopping]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+        if self._read_executor is not None:
+            self._read_executor.shutdown(wait=True)
+
+        self.log_stats()
+        return self.counters
+
+    def stop(self):
+        """ Stop reading and shut down without draining the queues """
+        self.stopped = True
+        if self._stopping is not None:
+            self._stopping.set()
+
+    def _put_line(self, line):
+        self.counters['lines'] += 1
+        if self._read_executor is not None:
+            self._read_executor.submit(self._on_read, line)
+        try:
+            self.line_queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.counters['dropped_read'] += 1
+
+    def _on_read(self, line):
+        try:
+            self.on_read(line)
+        except Exception:
+            logger.exception("Failed to handle read line")
+
+    async def _read(self, stream):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=1 << 16)
+        try:
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), stream)
+        except ValueError:
+            # Regular files can't be polled; read them on a thread instead
+            await self._read_threaded(stream)
+            return
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Line longer than the buffer limit, skip it
+                    logger.warning("Dropping oversized input line")
+                    continue
+                if not line:
+                    break
+                self._put_line(line.decode('utf-8', errors='replace'))
+                # Give the parse stage a turn when a burst is already buffered
+                await asyncio.sleep(0)
+        finally:
+            transport.close()
+
+    async def _read_threaded(self, stream):
+        loop = asyncio.get_running_loop()
+        eof = asyncio.Event()
+
+        def read():
+            for line in stream:
+                loop.call_soon_threadsafe(self._put_line, line)
+            loop.call_soon_threadsafe(eof.set)
+
+        threading.Thread(target=read, name="reader", daemon=True).start()
+        await eof.wait()
+
+    async def _parse_stage(self):
+        while True:
+            line = await self.line_queue.get()
+            try:
+                jobs = self.handle_line(line)
+                for stage, job in (jobs or {}).items():
+                    try:
+                        self.stage_queues[stage].put_nowait(job)
+                    except asyncio.QueueFull:
+                        self.counters['dropped_' + stage] += 1
+            except Exception:
+                logger.exception("Failed to handle line")
+            finally:
+                self.line_queue.task_done()
+
+    async def _output_stage(self, stage, executor):
+        loop = asyncio.get_running_loop()
+        queue = self.stage_queues[stage]
+        while True:
+            job = await queue.get()
+            try:
+                await loop.run_in_executor(executor, job)
+                self.counters['jobs_' + stage] += 1
+            except Exception:
+                self.counters['errors_' + stage] += 1
+                logger.exception("Pipeline %s job failed", stage)
+            finally:
+                queue.task_done()
+
+    async def _timer(self):
+        last_stats = time.monotonic()
+        while True:
+            await asyncio.sleep(1)
+            if self.on_tick is not None and self.on_tick() is False:
+                self.stop()
+            if self.stats_interval and time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                self.log_stats()
@@ -1,59 +1,33 @@
 #!/usr/bin/env python3
-import re
-import coloredlogs, logging, verboselogs
-from verboselogs import VerboseLogger as getLogger
+"""
+Parse one multimon-ng line into the legacy page model (see pagemodels).
+
+Kept for listen.py and other callers of process_line(); the parsing itself
+is done by the same PageParser norcom_pager uses.
+"""
+import logging
+
 import pagemodels
-import inspect 
-
-coloredlogs.install(fmt="%(asctime)s - %(levelname)s - %(message)s")
-logger = getLogger(__name__)
-logger.disabled = True  # change this if you want colored logs
-
-
-def process_line(line):
-
-    # Extract valid payload
-    m = re.match(
-        "POCSAG1200: Address: +(\d+)  Function: \d  Alpha: ([A-Za-z0-9#;:@ <>\/*\"\-\(\)'.,?]+).*",
-        line,
-    )
-    if not m:
-        if "Alpha" not in line:
-            logger.spam(line)
-            return
-        logger.error(line)
-        return
-
-    address = m.group(1)
-    payload = m.group(2).split("<EOT>")[0]
-    # Return if corrupted payload
-    if len(payload) < 16 or any(
-        x in payload
-        for x in ["<SOH>", "<DEL>", "<SI>", "<CAN>", "<EM>", "<DC2>", "<DC4>", "<NAK>"]
-    ):
-        logger.spam(line)
-        return
-    # Keep alive messages are spam
-    if "  SNO911: PAGEGATE KEEP ALIVE NORMAL" == payload:
-        logger.spam(payload)
-        return
-
-    for cls in get_subclasses(pagemodels, pagemodels.Page):
-        match = re.match(cls.pattern, payload)
-        if match:
-            page = cls(address, payload)
-            logger.info(page)
-            return page
-    return
-
-def get_subclasses(mod, cls):
-    """Yield the classes in module ``mod`` that inherit from ``cls``"""
-    for name, obj in inspect.getmembers(mod):
-        if hasattr(obj, "__bases__") and cls in obj.__bases__:
-            yield obj
+from PageParser import PageParser
+
+logger = logging.getLogger(__name__)
+
+# Built once; holds the compiled line pattern and parse cache
+_parser = PageParser()
+
+
+def process_line(line, parser=None):
+    page = (parser or _parser).parse(line.strip())
+    if page is None:
+        return None
+
+    legacy = pagemodels.from_page(page)
+    if legacy is not None:
+        logger.debug(legacy)
+    return legacy
 
 
 if __name__ == "__main__":
     import sys
 
-    process_line(sys.argv[1])
+    print(process_line(sys.argv[1]))
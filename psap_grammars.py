@@ -0,0 +1,77 @@
+"""
+Incident page grammar of each PSAP (see page_grammar).
+
+Pages of a PSAP whose grammar is None are discarded without parsing.
+"""
+import re
+
+from page_grammar import (
+    DelimitedGrammar, SequenceGrammar, Token, OneOf, Field,
+    strip, leading, remove_chars, unit_list,
+)
+
+UNIT_ID_RE = re.compile(r"[A-Z]+[0-9]+")
+
+
+def norcom_call_type(value):
+    """ "<FIRE - Alarm>" -> ("FIRE", "Alarm"), the subtype is optional """
+    call = value.strip().replace('<', '').replace('>', '')
+    if "-" in call:
+        (call_type, call_subtype) = call.split('-', 1)
+        return (call_type.strip(), call_subtype.strip())
+    return (call, None)
+
+
+def sno911_call_type(value):
+    """ "FIRE - Alarm" -> ("FIRE", "Alarm") """
+    (call_type, sep, call_subtype) = value.partition('-')
+    if not sep:
+        raise ValueError("no call subtype")
+    return (call_type.strip(), call_subtype.strip())
+
+
+def truncated_unit_list(value):
+    """ A unit list cut off at the end of the page: drop the last unit if it's only part of an id """
+    units = [ k.strip() for k in value.split(',') ]
+    if UNIT_ID_RE.match(units[-1]) is None:
+        units.pop()
+    return units
+
+
+# CALL TYPE - SUBTYPE;CHANNEL;NAME;ADDRESS;UNIT,UNIT;LAT;LONG
+NORCOM_GRAMMAR = DelimitedGrammar(
+    'NORCOM', ';',
+    Field(('call_type', 'call_subtype'), norcom_call_type),
+    Field('channel', remove_chars('* -')),
+    Field('address_name', strip),
+    Field('address_raw', strip),
+    Field('units', unit_list(min_length=3)),
+    # Keep the coordinates without any text run into them
+    Field('geo.lat', leading(r'47\.[0-9]+')),
+    Field('geo.long', leading(r'-12[0-9]\.[0-9]+')),
+)
+
+# >>TYPE - SUBTYPE<< [FIRE TAC n] [- Alarm Level: n] ADDRESS / NAME / [ID] *UNITS* notes
+SNO911_GRAMMAR = SequenceGrammar(
+    'SNO911',
+    Token('call type', r">>([A-Za-z0-9 -]+)<<\s*",
+          Field(('call_type', 'call_subtype'), sno911_call_type)),
+    Token('channel', r"(FIRE\s+TAC\s+\d+)\s*",
+          Field('channel'), optional=True),
+    Token('alarm level', r"-\s+Alarm Level:\s+(\d+)\s*",
+          Field('alarm_level'), optional=True),
+    Token('address fields', r"(.*)/(.*?)/\s+([A-Z0-9]+)?\s?(?=\*)",
+          Field('address_raw'), Field('address_name'), Field('call_id')),
+    OneOf(
+        'units',
+        # Possessive, so a list without the closing * fails without backtracking
+        Token('units', r"\*+([A-Za-z0-9\s,]++)\*",
+              Field('units', unit_list()), rest=Field('call_notes', strip)),
+        # Some pages are too long to include all of the units
+        Token('units', r"\*+([A-Za-z0-9\s,]+)",
+              Field('units', truncated_unit_list)),
+    ),
+)
+
+# Page layout not known yet
+VALCOM_GRAMMAR = None
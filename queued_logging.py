@@ -0,0 +1,108 @@
+"""
+Queued logging, so writing log records (to a log file on a slow SD card,
+say) never stalls page ingest.
+
+start_queued_logging() moves the root logger's handlers behind a
+QueueListener thread and puts a DroppingQueueHandler in their place. The
+queue is bounded: if the writer falls behind, records are dropped and
+counted rather than blocking the caller, and the count is logged once
+there is room again.
+
+RateLimitFilter lets through at most `burst` records of each message per
+`interval` seconds, for loggers that can repeat the same message for every
+line of a noisy channel (parse failures).
+"""
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler that drops records when the queue is full instead of blocking """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        # Called with the handler lock held
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self._dropped_record())
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _dropped_record(self):
+        return logger.makeRecord(logger.name, logging.WARNING, __file__, 0,
+                                 "Log queue full, dropped %d log records", (self.dropped,), None)
+
+
+class QueueWriter(logging.handlers.QueueListener):
+
+    def enqueue_sentinel(self):
+        # Wait for room rather than failing on a full queue at shutdown
+        self.queue.put(self._sentinel)
+
+
+def start_queued_logging(queue_size=10000):
+    """ Hand the root logger's records to a background writer thread; returns the listener """
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    log_queue = queue.Queue(queue_size)
+
+    listener = QueueWriter(log_queue, *handlers, respect_handler_level=True)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+
+    listener.start()
+    # Registered after logging's own shutdown hook, so it runs before it
+    atexit.register(listener.stop)
+    return listener
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through `burst` records of each message (the unformatted template)
+    per `interval` seconds. The first record of the next interval notes how
+    many were suppressed. Debug records always pass.
+    """
+
+    # Forget all messages when this many distinct ones are tracked
+    MAX_MESSAGES = 1024
+
+    def __init__(self, burst=10, interval=60):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # message -> [interval start, records passed, records suppressed]
+        self._messages = {}
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG:
+            return True
+
+        now = time.monotonic()
+        window = self._messages.get(record.msg)
+        if window is None or now - window[0] >= self.interval:
+            if window is None and len(self._messages) >= self.MAX_MESSAGES:
+                self._messages.clear()
+            suppressed = window[2] if window is not None else 0
+            self._messages[record.msg] = [now, 1, 0]
+            if suppressed:
+                record.msg = "%s (%d similar messages suppressed)" % (record.getMessage(), suppressed)
+                record.args = None
+            return True
+
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+
+        window[2] += 1
+        return False
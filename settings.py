@@ -1,4 +1,4 @@
-from typing import Optional, ClassVar
+from typing import Optional, ClassVar, Dict
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -15,6 +15,17 @@ class Settings(BaseSettings):
     LOGFILE: Optional[str] = None
     LOGLEVEL: int = 20
 
+    # Write log records from a background thread, so a slow log file never
+    # blocks page ingest. Records are dropped (and counted) while
+    # LOG_QUEUE_SIZE are waiting to be written.
+    LOG_QUEUE: bool = False
+    LOG_QUEUE_SIZE: int = 10000
+
+    # Log each parse failure message at most LOG_RATE_LIMIT times per
+    # LOG_RATE_INTERVAL seconds (0 to log every one)
+    LOG_RATE_LIMIT: int = 10
+    LOG_RATE_INTERVAL: int = 60
+
     # Publish incident pages to MQTT
     MQTT_ENABLE: bool = False
 
@@ -31,14 +42,128 @@ class Settings(BaseSettings):
     MQTT_USER: Optional[str] = None
     MQTT_PASS: Optional[str] = None
 
+    # Directory for the durable MQTT outbox. Messages are saved here before
+    # publishing (as QoS 1) and replayed after a broker outage or restart.
+    MQTT_OUTBOX: Optional[str] = None
+    MQTT_OUTBOX_MAX_BYTES: int = 64 * 1024 * 1024
+    # Messages per second when replaying the backlog after reconnecting
+    MQTT_OUTBOX_DRAIN_RATE: float = 20.0
+    # fsync after every message (safer, but slow on SD cards)
+    MQTT_OUTBOX_FSYNC: bool = False
+
+    # Payload format for published messages: json, cbor or msgpack.
+    # Binary formats are published under a "<format>/v<schema>/" topic prefix.
+    MQTT_PAYLOAD_FORMAT: str = "json"
+
+    # Per topic family overrides (incident, keepalive, text), e.g.
+    # MQTT_PAYLOAD_FORMATS='{"incident": "cbor"}'
+    MQTT_PAYLOAD_FORMATS: Dict[str, str] = {}
+
+    # Publish a page sent to several capcodes only once, with a "capcodes"
+    # list. Copies of the same text within this many seconds are merged
+    # (0 to disable).
+    MQTT_DEDUP_TTL: float = 0
+
+    # Hold the first copy this long to collect the other capcodes (0 to
+    # publish it straight away with just its own capcode)
+    MQTT_DEDUP_HOLD_MS: int = 1500
+
+    # Max distinct pages remembered for dedup
+    MQTT_DEDUP_MAX_ENTRIES: int = 4096
+
+    # Merge pages by CAD reference and publish a retained state topic per
+    # incident (incident/<psap>/<reference>) plus deltas on .../delta
+    INCIDENT_TRACKING: bool = False
+
+    # Forget incidents this many seconds after their last page
+    INCIDENT_TTL: int = 6 * 3600
+
+    # Save the incident table here so it survives restarts
+    INCIDENT_STATE_FILE: Optional[str] = None
+    INCIDENT_STATE_SAVE_SECONDS: int = 30
+
+    # Remember the parsed fields of this many recent page texts, so copies
+    # sent to other capcodes skip the parser (0 to disable)
+    PARSE_CACHE_SIZE: int = 256
+
+    # Size of the line-aligned chunks handed to each --backfill worker
+    BACKFILL_CHUNK_BYTES: int = 8 * 1024 * 1024
+
     # Save each page to a local file
     OUTPUT_FILE: Optional[str] = None
 
-    ## Format to write the output lines. Currently only json is supported
+    ## Format to write the output lines: json (legacy "{...}," lines), ndjson,
+    ## or csv. json stays the default so existing output files aren't mixed
     OUTPUT_FORMAT: str = "json"
 
+    # Rotate the output file after this many bytes / seconds (0 to disable)
+    OUTPUT_ROTATE_BYTES: int = 0
+    OUTPUT_ROTATE_SECONDS: int = 0
+
+    # Compress rotated output files: gzip, xz or None
+    OUTPUT_COMPRESS: Optional[str] = None
+
+    # Write buffered pages every N pages or T milliseconds, whichever is first
+    OUTPUT_FLUSH_EVERY: int = 1
+    OUTPUT_FLUSH_MS: int = 0
+
+    # fsync the output file after each flush
+    OUTPUT_FSYNC: bool = False
+
+    # Keep a sparse time index next to ndjson/json output (<file>.idx)
+    OUTPUT_INDEX: bool = False
+
+    # Append every raw multimon-ng line to this file, with a time index
+    # (<file>.idx) for replay --since/--until
+    RAW_ARCHIVE: Optional[str] = None
+
+    # Close an index block every N bytes or T seconds of page timestamps
+    ARCHIVE_INDEX_BLOCK_BYTES: int = 64 * 1024
+    ARCHIVE_INDEX_BLOCK_SECONDS: int = 300
+
     # Write Pagergate keepalives to file
     OUTPUT_FILE_KEEPALIVES: bool = False
 
+    # Run the asyncio pipeline (decoupled read/parse/publish/write stages)
+    PIPELINE_ASYNC: bool = False
+
+    # Max items waiting in each pipeline queue before new ones are dropped
+    PIPELINE_QUEUE_SIZE: int = 1000
+
+    # Seconds between pipeline queue depth/drop counter log lines (0 to disable)
+    PIPELINE_STATS_INTERVAL: int = 60
+
+    # Save each parsed page to a SQLite database
+    SQLITE_DB: Optional[str] = None
+
+    # Commit SQLite inserts every N pages or T milliseconds, whichever is first
+    SQLITE_BATCH_SIZE: int = 100
+    SQLITE_BATCH_MS: int = 1000
+
+    # Serve Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics
+    METRICS_PORT: Optional[int] = None
+    METRICS_HOST: str = "127.0.0.1"
+
+    # Also publish the metrics text (retained) to this MQTT topic every
+    # METRICS_MQTT_INTERVAL seconds
+    METRICS_MQTT_TOPIC: Optional[str] = None
+    METRICS_MQTT_INTERVAL: int = 60
+
+    # Trace each live page from its multimon-ng timestamp to the broker ack
+    # (traced pages are published at QoS 1 so the broker acknowledges them)
+    LATENCY_TRACING: bool = False
+    # Write each page's spans as a JSON line here (otherwise debug log)
+    LATENCY_TRACE_FILE: Optional[str] = None
+    # Percentiles are over the last LATENCY_WINDOW pages per PSAP and call type
+    LATENCY_WINDOW: int = 1000
+    # Seconds to wait for a broker ack before giving up on a trace
+    LATENCY_ACK_TIMEOUT: int = 30
+    # Log the percentiles every N seconds (0 to only log them at exit)
+    LATENCY_SUMMARY_INTERVAL: int = 300
+
     KEEPALIVE_INTERVAL: int = 120
     KEEPALIVE_MISSED: int = 3   
+    # Check for missed keepalives at least every N seconds, even with no input
+    KEEPALIVE_CHECK_SECONDS: float = 5.0
+    # Publish the keepalive health state (retained) to this MQTT topic
+    KEEPALIVE_HEALTH_TOPIC: Optional[str] = "page/pagegate_health"
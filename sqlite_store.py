@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+SQLite incident store.
+
+Parsed pages are stored in normalized tables:
+
+    incidents   one row per CAD reference (call_id), first/last seen
+    pages       one row per page, linked to its incident if it has one
+    page_units  one row per unit on a page
+
+The database runs in WAL mode and inserts are batched into a single
+transaction every `batch_size` pages or `batch_ms` milliseconds, so a busy
+night costs a handful of commits rather than one per page.
+
+    ./sqlite_store.py pages.db --unit E71 --since "2024-01-01 00:00:00"
+"""
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+
+from PageParser import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents (
+    id INTEGER PRIMARY KEY,
+    call_id TEXT NOT NULL UNIQUE,
+    psap TEXT,
+    first_seen INTEGER,
+    last_seen INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    timestamp INTEGER NOT NULL,
+    capcode TEXT,
+    psap TEXT,
+    incident_id INTEGER REFERENCES incidents(id),
+    call_type TEXT,
+    call_subtype TEXT,
+    alarm_level TEXT,
+    channel TEXT,
+    address_name TEXT,
+    address TEXT,
+    lat TEXT,
+    long TEXT,
+    cad_notes TEXT
+);
+
+CREATE TABLE IF NOT EXISTS page_units (
+    page_id INTEGER NOT NULL REFERENCES pages(id),
+    unit TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS pages_timestamp ON pages(timestamp);
+CREATE INDEX IF NOT EXISTS pages_psap ON pages(psap, timestamp);
+CREATE INDEX IF NOT EXISTS pages_call_type ON pages(call_type, timestamp);
+CREATE INDEX IF NOT EXISTS pages_incident ON pages(incident_id);
+CREATE INDEX IF NOT EXISTS page_units_unit ON page_units(unit, page_id);
+CREATE INDEX IF NOT EXISTS page_units_page ON page_units(page_id);
+"""
+
+
+class SQLiteStore:
+
+    # Pages kept for retrying while writes keep failing, in batches
+    MAX_PENDING_BATCHES = 100
+
+    def __init__(self, path, batch_size=100, batch_ms=1000):
+        self.path = path
+        self.batch_size = max(batch_size, 1)
+        self.batch_ms = batch_ms
+
+        # Pages arrive on the pipeline's write thread, the flush timer runs on its own
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+        self._lock = threading.Lock()
+        self._batch = []
+        self._batched_at = None
+        self._closed = False
+
+        self._flusher = None
+        if self.batch_ms > 0:
+            self._flusher = threading.Thread(target=self._flush_timer, name="sqlite-flush", daemon=True)
+            self._flusher.start()
+
+    def write_page(self, page):
+        geo = page.geo or {}
+        row = (
+            page.timestamp, page.capcode, str(page.psap), page.call_id,
+            page.call_type, page.call_subtype, page.alarm_level, page.channel,
+            page.address_name, page.address_raw, geo.get('lat'), geo.get('long'),
+            page.call_notes, tuple(page.units),
+        )
+        with self._lock:
+            if self._batched_at is None:
+                self._batched_at = time.monotonic()
+            self._batch.append(row)
+            if len(self._batch) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        """ Insert the batch in one transaction; on failure it's kept to retry on the next flush """
+        if not self._batch:
+            return
+
+        cur = self.db.cursor()
+        try:
+            cur.execute("BEGIN")
+            for (timestamp, capcode, psap, call_id, call_type, call_subtype, alarm_level, channel,
+                 address_name, address, lat, long, cad_notes, units) in self._batch:
+                incident_id = None
+                if call_id:
+                    cur.execute(
+                        "INSERT INTO incidents (call_id, psap, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(call_id) DO UPDATE SET "
+                        "first_seen = min(first_seen, excluded.first_seen), "
+                        "last_seen = max(last_seen, excluded.last_seen)",
+                        (call_id, psap, timestamp, timestamp)
+                    )
+                    incident_id = cur.execute("SELECT id FROM incidents WHERE call_id = ?", (call_id,)).fetchone()[0]
+
+                cur.execute(
+                    "INSERT INTO pages (timestamp, capcode, psap, incident_id, call_type, call_subtype, "
+                    "alarm_level, channel, address_name, address, lat, long, cad_notes) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (timestamp, capcode, psap, incident_id, call_type, call_subtype,
+                     alarm_level, channel, address_name, address, lat, long, cad_notes)
+                )
+                page_id = cur.lastrowid
+                if units:
+                    cur.executemany("INSERT INTO page_units (page_id, unit) VALUES (?, ?)",
+                                    [(page_id, unit) for unit in units])
+            cur.execute("COMMIT")
+        except sqlite3.Error:
+            if self.db.in_transaction:
+                try:
+                    cur.execute("ROLLBACK")
+                except sqlite3.Error as err:
+                    logger.error("Failed to roll back SQLite batch: %s", err)
+            self._limit_pending()
+            raise
+
+        self._batch = []
+        self._batched_at = None
+
+    def _limit_pending(self):
+        max_pending = self.batch_size * self.MAX_PENDING_BATCHES
+        if len(self._batch) > max_pending:
+            dropped = len(self._batch) - max_pending
+            del self._batch[:dropped]
+            logger.error("SQLite writes keep failing, dropped the %d oldest pages", dropped)
+
+    def _flush_timer(self):
+        interval = self.batch_ms / 1000.0
+        while not self._closed:
+            time.sleep(interval)
+            with self._lock:
+                if self._closed:
+                    break
+                if self._batched_at is not None and time.monotonic() - self._batched_at >= interval:
+                    try:
+                        self._flush()
+                    except sqlite3.Error as err:
+                        logger.error("Failed to write to SQLite store: %s", err)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._flush()
+            finally:
+                self.db.close()
+
+    def unit_pages(self, unit, since=None, until=None):
+        """ Return pages a unit was dispatched on, newest first """
+        query = (
+            "SELECT p.timestamp, p.psap, p.call_type, p.call_subtype, p.address, i.call_id "
+            "FROM page_units u JOIN pages p ON p.id = u.page_id "
+            "LEFT JOIN incidents i ON i.id = p.incident_id "
+            "WHERE u.unit = ?"
+        )
+        args = [unit]
+        if since is not None:
+            query += " AND p.timestamp >= ?"
+            args.append(since)
+        if until is not None:
+            query += " AND p.timestamp < ?"
+            args.append(until)
+        query += " ORDER BY p.timestamp DESC"
+        with self._lock:
+            return self.db.execute(query, args).fetchall()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Query the page SQLite store")
+    argparser.add_argument('db', help='SQLite database file')
+    argparser.add_argument('--unit', required=True, help='Unit ID, e.g. E71')
+    argparser.add_argument('--since', help='Start time (YYYY-MM-DD HH:MM:SS)')
+    argparser.add_argument('--until', help='End time (YYYY-MM-DD HH:MM:SS)')
+    args = argparser.parse_args()
+
+    store = SQLiteStore(args.db, batch_ms=0)
+    try:
+        rows = store.unit_pages(
+            args.unit,
+            since=parse_timestamp(args.since) if args.since else None,
+            until=parse_timestamp(args.until) if args.until else None,
+        )
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        store.close()
+
+    for timestamp, psap, call_type, call_subtype, address, call_id in rows:
+        print("{}  {:<7} {:<30} {:<40} {}".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)), psap,
+            " - ".join(k for k in (call_type, call_subtype) if k), address or "", call_id or ""))
+
+
+if __name__ == "__main__":
+    main()
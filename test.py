@@ -1,23 +1,39 @@
-import sys
+import argparse
 import logging, coloredlogs, verboselogs
 from PageParser import PageParser
+from archive_index import IndexedArchive, parse_time_arg
+from capture_reader import CaptureReader
 
 coloredlogs.install(level=11,fmt='%(asctime)s - %(levelname)s - %(message)s')
-filename = sys.argv[1]
+
+argparser = argparse.ArgumentParser(description="Parse a raw capture and report each page")
+argparser.add_argument('filename')
+argparser.add_argument('--since', help='Start time (YYYY-MM-DD HH:MM:SS or epoch)')
+argparser.add_argument('--until', help='End time (YYYY-MM-DD HH:MM:SS or epoch)')
+argparser.add_argument('--capcode', help='Only pages for this capcode')
+argparser.add_argument('--offset', type=int, default=0, help='Start at this byte offset')
+argparser.add_argument('--follow', action='store_true', help='Keep reading lines appended to the file')
+args = argparser.parse_args()
+
+if args.since or args.until or args.capcode:
+    archive = IndexedArchive(args.filename)
+    lines = archive.lines(since=parse_time_arg(args.since), until=parse_time_arg(args.until), capcode=args.capcode)
+else:
+    lines = CaptureReader(args.filename, offset=args.offset, follow=args.follow).lines()
 
 parser = PageParser()
-with open(filename, "r") as rawfile:
-    for line in rawfile.readlines():
-        page = parser.parse(line)
+for _, raw_line in lines:
+    line = raw_line.decode('utf-8', errors='replace')
+    page = parser.parse(line)
 
-        if page is None:
-            logging.error("FAIL: {}".format(line))
-            continue
+    if page is None:
+        logging.error("FAIL: {}".format(line))
+        continue
 
-        if page.parsed:
-            logging.info("OK: {}".format(page.to_json()))
-        elif page.skipped:
-            logging.warning("SKIP: {} {}".format(page.skip_reason, page.alpha))
-        else:
-            logging.error("FAIL: {}".format(page.raw))
+    if page.parsed:
+        logging.info("OK: {}".format(page.to_json()))
+    elif page.skipped:
+        logging.warning("SKIP: {} {}".format(page.skip_reason, page.alpha))
+    else:
+        logging.error("FAIL: {}".format(page.raw))
 
@@ -1,13 +1,31 @@
 #!/usr/bin/env python3
 import sys
 import logging
+import argparse
 
 from PageParser import PageParser
 from PageParser import PagePSAP
+from capture_reader import CaptureReader
 
 logger = logging.getLogger(__name__)
 
+def input_lines(args):
+    """ Lines from the capture file if one was given, otherwise stdin """
+    if args.file is None:
+        yield from sys.stdin
+        return
+
+    with CaptureReader(args.file, offset=args.offset, follow=args.follow) as reader:
+        for _, line in reader.lines():
+            yield line.decode('utf-8', errors='replace')
+
 def main():
+    argparser = argparse.ArgumentParser(description="Report pages that fail to parse")
+    argparser.add_argument('file', nargs='?', help='Raw capture to read instead of stdin')
+    argparser.add_argument('--offset', type=int, default=0, help='Start at this byte offset')
+    argparser.add_argument('--follow', action='store_true', help='Keep reading lines appended to the file')
+    args = argparser.parse_args()
+
     loglevel = logging.ERROR
     logformat = '[%(asctime)s] %(levelname)s %(module)s.%(funcName)s %(message)s'
     logging.basicConfig(format=logformat, datefmt='%Y-%m-%d %H:%M:%S', level=loglevel)
@@ -16,7 +34,7 @@ def main():
 
     while True:
         try:
-            for line in sys.stdin:
+            for line in input_lines(args):
                 line = line.strip()
 
                 # logger.info("Received %s", " ".join(line.split()[:5]))
@@ -67,6 +85,9 @@ def main():
                 #     logger.info("Raw Alpha: %s", page.alpha)
                 # else:
                 #     page = None
+
+            if args.file is not None:
+                break
         except KeyboardInterrupt:
             print("")
             sys.exit(0)